@@ -26,20 +26,28 @@
 # visible map around them.  The respond with the action
 # they decide to take during that turn
 import json
+import logging
 
+from agent.agent_messages import path_request_message
 from shared.constants import *
 from simulation.point import Point
 from simulation.visible_map import VisibleMap
+from simulation.visible_map_delta import VisibleMapDecoder
 
 
 class Agent:
-    def __init__(self, to_me_queue, from_me_queue, initial_location, initial_visible_map, sight_radius, name):
+    def __init__(self, to_me_queue, from_me_queue, initial_location, initial_visible_map, sight_radius, name,
+                 shared_grid=None):
         self.to_me_queue = to_me_queue
         self.from_me_queue = from_me_queue
         self.location = initial_location
         self.visible_map = initial_visible_map
         self.sight_radius = sight_radius
         self.name = name
+        # the simulation's SharedGrid, when visible maps arrive as window bounds instead of cells
+        self.shared_grid = shared_grid
+        # the window built up from delta-encoded visible maps, when the simulation sends those
+        self.visible_map_decoder = VisibleMapDecoder()
         self.sim_messages = []
 
     def get_sim_message(self):
@@ -62,8 +70,39 @@ class Agent:
     def put_sim_message(self, message):
         self.from_me_queue.put(message)
 
+    def request_path(self, from_location, to_location):
+        """Ask the simulation's path planning service for a path and wait for the answer;
+           other simulation messages that arrive meanwhile are kept for receive_sim_message"""
+        self.put_sim_message(path_request_message(self.name, from_location, to_location))
+        while True:
+            message = self.get_sim_message()
+            if message[MESSAGE_TYPE] == PATH_RESPONSE:
+                if message[PATH] is None:
+                    return None
+                return [Point.from_dict(location) for location in message[PATH]]
+            self.sim_messages.append(message)
+            if message[MESSAGE_TYPE] == SHUTDOWN:
+                return None
+
     def update_location_and_visible_map(self, visible_map_around_point):
         self.location = Point(visible_map_around_point[YOUR_LOCATION][X], visible_map_around_point[YOUR_LOCATION][Y])
-        self.visible_map = VisibleMap(visible_map_around_point[GRID],
-                                      visible_map_around_point[MIN_X],
-                                      visible_map_around_point[MIN_Y])
+        entities = visible_map_around_point.get(ENTITIES)
+        if GRID in visible_map_around_point:
+            array = visible_map_around_point[GRID]
+        elif CHANGES in visible_map_around_point:
+            array, entities = self.visible_map_decoder.apply(visible_map_around_point)
+        else:
+            if self.shared_grid.version() != visible_map_around_point[GRID_VERSION]:
+                logging.warning("{}: shared grid is at version {} but the visible map is for version {}"
+                                .format(self.name, self.shared_grid.version(), visible_map_around_point[GRID_VERSION]))
+            array = self.shared_grid.window(visible_map_around_point[MIN_X], visible_map_around_point[MIN_Y],
+                                            visible_map_around_point[MAX_X], visible_map_around_point[MAX_Y])
+        if isinstance(self.visible_map, VisibleMap):
+            # refilled in place every turn instead of building a new map, grid and arrays
+            self.visible_map.update(array, visible_map_around_point[MIN_X], visible_map_around_point[MIN_Y], entities)
+        else:
+            self.visible_map = VisibleMap(array,
+                                          visible_map_around_point[MIN_X],
+                                          visible_map_around_point[MIN_Y],
+                                          entities,
+                                          2 * self.sight_radius + 1)
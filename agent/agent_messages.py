@@ -61,6 +61,24 @@ def take_turn_fire_message(name, location, direction):
     return json.dumps(message)
 
 
+def path_request_message(name, from_location, to_location):
+    """Message that asks the simulation's path planning service for a path"""
+    message = {MESSAGE_TYPE: PATH_REQUEST,
+               FROM: name,
+               LOCATION: from_location.to_dict(),
+               GOAL: to_location.to_dict(),
+               TIMESTAMP: timestamp()}
+    return json.dumps(message)
+
+
+def path_response_message(path):
+    """Message that answers a path request with a list of locations, or None if there is no path"""
+    message = {MESSAGE_TYPE: PATH_RESPONSE,
+               PATH: None if path is None else [location.to_dict() for location in path],
+               TIMESTAMP: timestamp()}
+    return json.dumps(message)
+
+
 def mission_complete_message():
     """Message that indictes the mission is complete"""
     message = {MESSAGE_TYPE: MISSION_COMPLETE,
@@ -17,20 +17,29 @@
 import argparse
 import copy
 import logging
+import random
 import sys
 import time
 from multiprocessing import Process, Queue
 
+import numpy
 import pygame
 from pygame.locals import *
 
 from agent.agent_messages import *
 from graphics.pygame_constants import *
 from opfor.opfor import Opfor
+from simulation import a_star
+from simulation.cooperative_planner import CooperativePlanner
 from simulation.direction import Direction
 from simulation.drawable import Drawable
+from simulation.entity_registry import entity_color
 from simulation.missionmap import MissionMap
+from simulation.path_service import PathService
 from simulation.point import Point
+from simulation.scenario import save_scenario
+from simulation.shared_grid import SharedGrid
+from simulation.visible_map_delta import VisibleMapEncoder
 from warbot.warbot import Warbot
 from warbot.warbot_radio_broker import WarbotRadioBroker
 
@@ -41,8 +50,22 @@ class AutoAssault:
         self.mission_complete = False
         # generate map
         self.mission_map = MissionMap(args)
+        # resolves the moves requested each turn so agents never collide
+        self.cooperative_planner = CooperativePlanner(self.mission_map)
+        # plans warbot paths in worker processes when warbots are set to use it
+        self.path_service = PathService(self.mission_map, args.s) if args.s > 0 else None
+        # what each agent was last sent, when visible maps are sent as deltas instead; lazy terrain always
+        # uses deltas, since the first copy into the shared grid would generate every terrain chunk
+        self.visible_map_encoders = {} if args.d or args.lazy_terrain else None
+        # otherwise agents read their visible maps from this copy of the grid instead of from your turn messages;
+        # it is as big as the whole world, so delta messages are the better choice for very large worlds
+        self.shared_grid = None if self.visible_map_encoders is not None else \
+            SharedGrid(self.mission_map.grid.width, self.mission_map.grid.height)
+        # lazily generated terrain chunks further than this many chunks from every agent are dropped (0 keeps them)
+        self.terrain_eviction_distance = args.evict_terrain
         # create IPC queues and warbot radio message broker
         self.to_agent_queues = []
+        self.to_agent_queues_by_name = {}
         self.to_all_warbots_queue = Queue()
         self.warbot_radio_broker = WarbotRadioBroker(self.to_all_warbots_queue)
         self.warbot_radio_broker_process = Process(target=self.warbot_radio_broker.run)
@@ -52,11 +75,19 @@ class AutoAssault:
         self.opfors = []   # but not in these objects
         self.civilians = []  # civilians are not agents (no child processes)
         self.active_agents = set()
+        # grid version the display last caught up with
+        self.drawn_grid_version = 0
+        # world cell drawn in the top left corner of the window
+        self.viewport_x = 0
+        self.viewport_y = 0
 
 # simulation setup methods
     def create_warbots(self, to_sim_queue):
         """Create warbot objects and associated child processes"""
         logging.debug("Creating {} warbots".format(len(self.mission_map.warbot_locations)))
+        # computed once here and shared with every warbot process
+        flow_fields = self.mission_map.generate_flow_fields()
+        hierarchical_map = self.mission_map.get_hierarchical_map()
         for location in self.mission_map.warbot_locations.values():
             to_queue = Queue()
             self.to_agent_queues.append(to_queue)
@@ -66,7 +97,10 @@ class AutoAssault:
             to_this_warbot_queue = Queue()
             warbot = Warbot(to_queue, to_sim_queue, location, visible_map,
                             name, to_this_warbot_queue, self.warbot_radio_broker,
-                            self.mission_map.objective_location, self.mission_map.rally_point_location)
+                            self.mission_map.objective_location, self.mission_map.rally_point_location,
+                            self.mission_map.grid.width, self.mission_map.grid.height,
+                            flow_fields, hierarchical_map, self.path_service is not None, self.shared_grid)
+            self.to_agent_queues_by_name[warbot.name] = to_queue
             self.active_agents.add(warbot.name)
             self.warbots.append(warbot)
             process = Process(target=warbot.run)
@@ -81,7 +115,8 @@ class AutoAssault:
             visible_map = self.mission_map.get_visible_map_around_point(location, OPFOR_VISION_DISTANCE)
             name = self.mission_map.get_named_drawable_at_location(location, OPFOR_PREFIX)
             logging.info("Creating OPFOR {} at location {}".format(name, location))
-            opfor = Opfor(to_queue, to_sim_queue, location, visible_map, name)
+            opfor = Opfor(to_queue, to_sim_queue, location, visible_map, name, self.shared_grid)
+            self.to_agent_queues_by_name[opfor.name] = to_queue
             self.active_agents.add(opfor.name)
             self.opfors.append(opfor)
             process = Process(target=opfor.run)
@@ -101,30 +136,53 @@ class AutoAssault:
                 self.terminate()
 
     def get_color(self, mission_map, x, y):
+        # agents are drawn over what is beneath them; not every agent has a Drawable
+        entity_names = mission_map.grid.entities_at(Point(x, y))
+        if len(entity_names) > 0:
+            return entity_color(entity_names[0])
         drawables = mission_map.grid[Point(x, y)]
         if len(drawables) >= 1:
             return drawables[0].color
         else:
             return Colors.BLACK, Colors.BLACK
 
+    def center_viewport(self):
+        """Move the viewport to keep the warbots in view; True if it moved"""
+        grid = self.mission_map.grid
+        locations = list(self.mission_map.warbot_locations.values())
+        if len(locations) == 0:
+            return False
+        center_x = sum(location.x for location in locations) // len(locations)
+        center_y = sum(location.y for location in locations) // len(locations)
+        viewport_x = min(max(center_x - VIEWPORT_COLUMNS // 2, 0), max(grid.width - VIEWPORT_COLUMNS, 0))
+        viewport_y = min(max(center_y - VIEWPORT_ROWS // 2, 0), max(grid.height - VIEWPORT_ROWS, 0))
+        # only scroll once the warbots drift a quarter of the window away from the center
+        if abs(viewport_x - self.viewport_x) < VIEWPORT_COLUMNS // 4 and \
+                abs(viewport_y - self.viewport_y) < VIEWPORT_ROWS // 4:
+            return False
+        self.viewport_x = viewport_x
+        self.viewport_y = viewport_y
+        return True
+
+    def in_viewport(self, x, y):
+        return self.viewport_x <= x < self.viewport_x + VIEWPORT_COLUMNS and \
+            self.viewport_y <= y < self.viewport_y + VIEWPORT_ROWS
+
     def draw_grid(self, mission_map):
-        """Draw the map grid via pygame"""
+        """Draw the part of the map grid inside the viewport via pygame"""
         # draw gridlines
         for x in range(0, WINDOW_WIDTH, CELL_SIZE):  # draw vertical lines
             pygame.draw.line(DISPLAY_SURF, Colors.DARK_GRAY.value, (x, TOP_BUFFER), (x, WINDOW_HEIGHT + TOP_BUFFER))
         for y in range(TOP_BUFFER, WINDOW_HEIGHT, CELL_SIZE):  # draw horizontal lines
             pygame.draw.line(DISPLAY_SURF, Colors.DARK_GRAY.value, (0, y), (WINDOW_WIDTH, y))
         # draw grid objects
-        for x in range(0, mission_map.grid.width):
-            for y in range(0, mission_map.grid.height):
-                if mission_map.grid.array[x][y] != 0:  # use the internal array directly for speed
-                    (lineColor, fillColor) = self.get_color(mission_map, x, y)
-                    cell_x = x * CELL_SIZE
-                    cell_y = y * CELL_SIZE + TOP_BUFFER
-                    rect = pygame.Rect(cell_x, cell_y, CELL_SIZE, CELL_SIZE)
-                    pygame.draw.rect(DISPLAY_SURF, lineColor.value, rect)
-                    inner_rect = pygame.Rect(cell_x + 4, cell_y + 4, CELL_SIZE - 8, CELL_SIZE - 8)
-                    pygame.draw.rect(DISPLAY_SURF, fillColor.value, inner_rect)
+        max_x = min(self.viewport_x + VIEWPORT_COLUMNS, mission_map.grid.width) - 1
+        max_y = min(self.viewport_y + VIEWPORT_ROWS, mission_map.grid.height) - 1
+        # use the packed window directly for speed
+        window = mission_map.grid.window(self.viewport_x, self.viewport_y, max_x, max_y)
+        xs, ys = numpy.nonzero(window)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.draw_cell(x + self.viewport_x, y + self.viewport_y)
 
     def check_for_key_press(self):
         """See if the user pressed any key to quit at simulation over"""
@@ -188,48 +246,42 @@ class AutoAssault:
         """Draw the updated game state (mission_map) to the screen"""
         DISPLAY_SURF.fill(BG_COLOR.value)
         self.draw_grid(self.mission_map)
+        self.drawn_grid_version = self.mission_map.grid.version
         # draw_legend()
         pygame.display.update()
         FPS_CLOCK.tick(FPS)
 
-    def update_warbots(self):
-        """Draw the updated game state (mission_map) to the screen"""
-        for warbot in self.mission_map.warbot_locations.keys():
-            for location in [self.mission_map.warbot_locations[warbot],
-                             self.mission_map.previous_warbot_locations[warbot]]:
-                if location is not None:
-                    (lineColor, fillColor) = self.get_color(self.mission_map, location.x, location.y)
-                    cell_x = location.x * CELL_SIZE
-                    cell_y = location.y * CELL_SIZE + TOP_BUFFER
-                    rect = pygame.Rect(cell_x, cell_y, CELL_SIZE, CELL_SIZE)
-                    pygame.draw.rect(DISPLAY_SURF, lineColor.value, rect)
-                    inner_rect = pygame.Rect(cell_x + 4, cell_y + 4, CELL_SIZE - 8, CELL_SIZE - 8)
-                    pygame.draw.rect(DISPLAY_SURF, fillColor.value, inner_rect)
-        pygame.display.update()
-        FPS_CLOCK.tick(FPS)
-
-    def update_bullets(self):
-        """Only animate bullets"""
-        for bullet in self.mission_map.bullets:
-            for location in [bullet.location, bullet.prev_location]:
-                if location is not None:
-                    (lineColor, fillColor) = self.get_color(self.mission_map, location.x, location.y)
-                    cell_x = location.x * CELL_SIZE
-                    cell_y = location.y * CELL_SIZE + TOP_BUFFER
-                    rect = pygame.Rect(cell_x, cell_y, CELL_SIZE, CELL_SIZE)
-                    pygame.draw.rect(DISPLAY_SURF, lineColor.value, rect)
-                    inner_rect = pygame.Rect(cell_x + 4, cell_y + 4, CELL_SIZE - 8, CELL_SIZE - 8)
-                    pygame.draw.rect(DISPLAY_SURF, fillColor.value, inner_rect)
+    def draw_cell(self, x, y):
+        (lineColor, fillColor) = self.get_color(self.mission_map, x, y)
+        cell_x = (x - self.viewport_x) * CELL_SIZE
+        cell_y = (y - self.viewport_y) * CELL_SIZE + TOP_BUFFER
+        rect = pygame.Rect(cell_x, cell_y, CELL_SIZE, CELL_SIZE)
+        pygame.draw.rect(DISPLAY_SURF, lineColor.value, rect)
+        inner_rect = pygame.Rect(cell_x + 4, cell_y + 4, CELL_SIZE - 8, CELL_SIZE - 8)
+        pygame.draw.rect(DISPLAY_SURF, fillColor.value, inner_rect)
+
+    def update_changed_cells(self):
+        """Draw only the cells of the mission_map written since the last draw"""
+        if self.center_viewport():
+            # everything on screen moved, so draw it all again
+            self.update_display()
+            return
+        grid = self.mission_map.grid
+        for x, y in grid.changed_cells(self.drawn_grid_version):
+            if self.in_viewport(x, y):
+                self.draw_cell(x, y)
+        self.drawn_grid_version = grid.version
         pygame.display.update()
         FPS_CLOCK.tick(FPS)
 
-# simulation main loop and helpers
     def terminate(self):
         """Simulation shutdown and clean-up"""
         logging.debug("Sending shutdown message to child processes . . .")
         for to_agent_queue in self.to_agent_queues:
             to_agent_queue.put(shutdown_message())
         self.to_all_warbots_queue.put(shutdown_message())
+        if self.path_service is not None:
+            self.path_service.shutdown()
         logging.debug("Waiting for child processes to shutdown . . .")
         for process in self.processes:
             process.join()
@@ -239,17 +291,30 @@ class AutoAssault:
         pygame.quit()
         sys.exit()
 
+    def answer_path_request(self, message):
+        """Plan the requested path in the path planning service and send it to the agent when it is ready"""
+        to_agent_queue = self.to_agent_queues_by_name[message[FROM]]
+        self.path_service.request_path(Point.from_dict(message[LOCATION]), Point.from_dict(message[GOAL]),
+                                       lambda path: to_agent_queue.put(path_response_message(path)))
+
+    def get_visible_map(self, agent, location, grid_version):
+        """Visible map for an agent's turn: a delta against what it was last sent, or bounds into the shared grid"""
+        if self.visible_map_encoders is None:
+            return self.mission_map.get_visible_map_around_point(location, agent.sight_radius, grid_version)
+        encoder = self.visible_map_encoders.setdefault(agent.name, VisibleMapEncoder())
+        return encoder.encode(self.mission_map, location, agent.sight_radius)
+
     def update_mission_map(self, messages_received):
         """Update game state (mission_map) from agent subprocess messages"""
         bullets_live = False
+        requested_moves = {}
         for message in messages_received:
             logging.debug("Simulation:  Received message: {}".format(message))
             if message[MESSAGE_TYPE] == TAKE_TURN:
                 agent = message[FROM]
                 action = message[ACTION]
                 if action == MOVE_TO:
-                    location = Point.from_dict(message[LOCATION])
-                    self.mission_map.move_agent(agent, location)
+                    requested_moves[agent] = Point.from_dict(message[LOCATION])
                 elif action == FIRE_AT:
                     location = Point.from_dict(message[LOCATION])
                     direction = Direction.from_str(message[DIRECTION])
@@ -258,9 +323,15 @@ class AutoAssault:
             elif message[MESSAGE_TYPE] == MISSION_COMPLETE:
                 self.mission_complete = True
                 return
+        # plan all of this turn's moves together so that no two agents end up in the same cell
+        for agent, location in self.cooperative_planner.plan_moves(requested_moves).items():
+            if location != requested_moves[agent]:
+                logging.debug("Simulation:  {} requested {} but moves to {}"
+                              .format(agent, requested_moves[agent], location))
+            self.mission_map.move_agent(agent, location)
         if bullets_live:
             while len(self.mission_map.bullets) > 0:
-                self.update_bullets()
+                self.update_changed_cells()
                 self.mission_map.move_bullets()
 
     def start_child_processes(self):
@@ -274,7 +345,8 @@ class AutoAssault:
         """Main simulation loop"""
         self.start_child_processes()
         quit_wanted = False
-        # Draw the whole map the first time; afterwards only draw updates for better performance
+        # Draw the whole viewport the first time; afterwards only draw updates for better performance
+        self.center_viewport()
         self.update_display()
         live_process_count = len(self.processes)
         while not self.mission_complete and not quit_wanted:  # main game loop
@@ -283,13 +355,16 @@ class AutoAssault:
             # give agents updated simulation state and await their actions for this turn
             agents_left = copy.deepcopy(self.active_agents)
             messages_received = []
+            grid_version = None
+            if self.visible_map_encoders is None:
+                grid_version = self.shared_grid.publish(self.mission_map.grid)
             for warbot in self.warbots:
                 warbot_location = self.mission_map.warbot_locations[warbot.name]
-                visible_map = self.mission_map.get_visible_map_around_point(warbot_location, warbot.sight_radius)
+                visible_map = self.get_visible_map(warbot, warbot_location, grid_version)
                 warbot.to_me_queue.put(your_turn_message(visible_map))
             for opfor in self.opfors:
                 opfor_location = self.mission_map.opfor_locations[opfor.name]
-                visible_map = self.mission_map.get_visible_map_around_point(opfor_location, opfor.sight_radius)
+                visible_map = self.get_visible_map(opfor, opfor_location, grid_version)
                 opfor.to_me_queue.put(your_turn_message(visible_map))
             # await "take_turn" response messages
             logging.debug("Waiting on turn responses . . .")
@@ -300,6 +375,8 @@ class AutoAssault:
                     messages_received.append(message)
                     logging.debug("Received {} turn responses out of {} expected.  Still need response from: {}"
                                   .format(len(messages_received), live_process_count, agents_left))
+                elif message[MESSAGE_TYPE] == PATH_REQUEST:
+                    self.answer_path_request(message)
                 elif message[MESSAGE_TYPE] == MISSION_COMPLETE:
                     self.mission_complete = True
                     break
@@ -309,8 +386,12 @@ class AutoAssault:
                 logging.debug("Done waiting on turn responses.  Updating mission_map")
                 # update mission_map
                 self.update_mission_map(messages_received)
-                # update warbot movement
-                self.update_warbots()
+                if self.terrain_eviction_distance > 0:
+                    evicted = self.mission_map.evict_terrain_chunks(self.terrain_eviction_distance)
+                    if evicted > 0:
+                        logging.debug("Evicted {} terrain chunks".format(evicted))
+                # draw the agents that moved and anything else that changed
+                self.update_changed_cells()
         # after the mission is complete or quit is indicated, clean-up and shutdown
         self.terminate()
 
@@ -321,10 +402,38 @@ def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', default=6, type=int, choices=range(2, 11),
                         help='number of rifle warbots (2 to 10)')
-    parser.add_argument('-e', default=6, type=int, choices=range(1, 11),
-                        help='number of enemies (1 to 10)')
-    parser.add_argument('-c', default=0, type=int, choices=range(0, 21),
-                        help='number of civilians (0 to 20)')
+    parser.add_argument('-e', default=6, type=int, choices=range(1, MAX_OPFOR + 1), metavar='E',
+                        help='number of enemies (1 to {})'.format(MAX_OPFOR))
+    parser.add_argument('-c', default=0, type=int, choices=range(0, MAX_CIVILIANS + 1), metavar='C',
+                        help='number of civilians (0 to {})'.format(MAX_CIVILIANS))
+    parser.add_argument('-p', default=A_STAR, choices=[A_STAR, JUMP_POINT_SEARCH],
+                        help='path finding algorithm used by warbots')
+    parser.add_argument('-b', default=0, type=int,
+                        help='most A* nodes a warbot may expand per turn (0 for no limit)')
+    parser.add_argument('-w', default=1.0, type=float,
+                        help='weighted A* heuristic factor, at least 1.0 (1.0 for plain A*)')
+    parser.add_argument('-s', default=0, type=int,
+                        help='worker processes in the path planning service (0 to have warbots plan their own paths)')
+    parser.add_argument('-t', default=TERRAIN_CACHE_DIRECTORY,
+                        help='directory to cache generated terrain in (an empty string to always generate it)')
+    parser.add_argument('-d', action='store_true',
+                        help='send agents only the visible map cells that changed instead of sharing the grid')
+    parser.add_argument('--width', default=None, type=int,
+                        help='width of the world in cells (defaults to the width of the window)')
+    parser.add_argument('--height', default=None, type=int,
+                        help='height of the world in cells (defaults to the height of the window)')
+    parser.add_argument('--lazy-terrain', action='store_true',
+                        help='generate terrain a chunk at a time where agents first look instead of all at start')
+    parser.add_argument('--evict-terrain', default=0, type=int, metavar='N',
+                        help='with --lazy-terrain, drop terrain chunks more than N chunks from every agent '
+                             '(0 to keep them all)')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='seed for the random number generator, so that runs can be repeated')
+    parser.add_argument('--save-scenario', default=None, metavar='FILE',
+                        help='save the generated map and agent placements to FILE')
+    parser.add_argument('--load-scenario', default=None, metavar='FILE',
+                        help='load the map and agent placements from FILE instead of generating them (-r, -e and -c '
+                             'are then ignored)')
     return parser.parse_args()
 
 
@@ -348,9 +457,20 @@ def main():
                         level=logging.DEBUG)
     # parse command line args
     args = parse_arguments()
+    # seed before anything is generated; agent processes inherit the seeded state when they are forked
+    if args.seed is not None:
+        random.seed(args.seed)
+        logging.info("Random seed is {}".format(args.seed))
+    # select the path finding algorithm, node budget and heuristic weight before the agent processes are forked
+    a_star.set_default_algorithm(args.p)
+    a_star.set_node_budget(args.b)
+    a_star.set_heuristic_weight(max(args.w, 1.0))
 
     # setup simulation
     auto_assault = AutoAssault(args)
+    if args.save_scenario is not None:
+        save_scenario(auto_assault.mission_map, args.save_scenario)
+        logging.info("Saved scenario to {}".format(args.save_scenario))
     to_sim_queue = Queue()
 
     # create warbots
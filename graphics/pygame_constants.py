@@ -33,6 +33,10 @@ CELL_SIZE = 10
 assert WINDOW_WIDTH % CELL_SIZE == 0, "Window width must be a multiple of cell size."
 assert WINDOW_HEIGHT % CELL_SIZE == 0, "Window height must be a multiple of cell size."
 
+# cells shown at once; a bigger world is drawn through a viewport of this size
+VIEWPORT_COLUMNS = WINDOW_WIDTH // CELL_SIZE
+VIEWPORT_ROWS = WINDOW_HEIGHT // CELL_SIZE
+
 # background color
 BG_COLOR = Colors.BLACK
 
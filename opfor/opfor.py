@@ -21,9 +21,9 @@ from agent.agent_messages import *
 
 class Opfor(Agent):
 
-    def __init__(self, to_me_queue, from_me_queue, initial_location, initial_visible_map, name):
+    def __init__(self, to_me_queue, from_me_queue, initial_location, initial_visible_map, name, shared_grid=None):
         Agent.__init__(self, to_me_queue, from_me_queue, initial_location,
-                       initial_visible_map, OPFOR_VISION_DISTANCE, name)
+                       initial_visible_map, OPFOR_VISION_DISTANCE, name, shared_grid)
         self.action_queue = []
         self.path = []
 
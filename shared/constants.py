@@ -22,6 +22,7 @@ Y = 'y'
 
 # message strings
 ACTION = "action"
+CHANGES = "changes"
 DIRECTION = "direction"
 DO_NOTHING = "do_nothing"
 ELECTION_NAME_DECLARE = "election_name_declare"  # also serves as ELECTION_BEGIN
@@ -29,11 +30,14 @@ ELECTION_COMPARE = "election_compare"
 ELECTION_END = "election_end"
 ELECTION_SLEEP_WAIT = 0.3
 ELECTION_WINNER_WAIT_CYCLES = 4
+ENTITIES = "entities"
 FLANKING_POSITION = "flanking_position"
 FLANKING_POSITION_WAYPOINT = "flanking_position_waypoint"
 FORMING_SQUAD_COLUMN_WEDGE = "forming_squad_column_wedge"
 FROM = "from"
+GOAL = "goal"
 GRID = "grid"
+GRID_VERSION = "grid_version"
 LIMIT_OF_ADVANCE = "limit_of_advance"
 LOCATION = "location"
 LOSER_NAME = "loser_name"
@@ -47,6 +51,9 @@ MOVE = "move"
 NAME = "name"
 ON_TEAM_A = "on_team_a"
 ON_TEAM_B = "on_team_b"
+PATH = "path"
+PATH_REQUEST = "path_request"
+PATH_RESPONSE = "path_response"
 READY_FOR_MOVEMENT = "ready_for_movement"
 READY_TO_FLANK = "ready_to_flank"
 IN_SECURITY_PERIMETER_POSITION = "in_security_perimeter_position"
@@ -127,6 +134,35 @@ SECURITY_PERIMETER_9_OFFSET = (-1, 0)
 SECURITY_PERIMETER_10_OFFSET = (1, 0)
 
 
+# path finding algorithms
+A_STAR = "a_star"
+JUMP_POINT_SEARCH = "jump_point_search"
+
+# time steps of look-ahead when planning every agent's move for a turn together
+COOPERATIVE_PLANNING_WINDOW = 4  # type: int
+
+# width and height, in cells, of the clusters used by hierarchical path finding
+HPA_CLUSTER_SIZE = 16  # type: int
+
+# paths the path planning service remembers before evicting the least recently used
+PATH_CACHE_SIZE = 512  # type: int
+
+# width and height, in cells, of the buckets the spatial hash groups agents into for range queries
+SPATIAL_HASH_BUCKET_SIZE = 8  # type: int
+
+# width and height, in cells, of the chunks the mission map's grid layers are stored in
+GRID_CHUNK_SIZE = 64  # type: int
+
+# largest map, in cells, that flow fields and the hierarchical cluster graph are built over; both cover
+# the whole map, and their build time grows much faster than its area
+WHOLE_MAP_PLANNING_MAX_CELLS = 192 * 192  # type: int
+
+# random cells tried for a free one before searching a mask of the whole map instead
+UNOCCUPIED_LOCATION_ATTEMPTS = 1000  # type: int
+
+# directory generated terrain is cached in, relative to where the simulation is started
+TERRAIN_CACHE_DIRECTORY = ".terrain_cache"  # type: str
+
 # agent actions
 MOVE_TO = "move_to"
 FIRE_AT = "fire_at"
@@ -136,6 +172,11 @@ WARBOT_PREFIX = "WARBOT_"
 OPFOR_PREFIX = "OPFOR_"
 CIVILIAN_PREFIX = "CIV_"
 
+# most OPFOR and civilians a simulation may hold; agents are tracked in an entity registry, so these
+# bound process count and turn time rather than any bitmask (warbots stay limited by squad formation slots)
+MAX_OPFOR = 500  # type: int
+MAX_CIVILIANS = 5000  # type: int
+
 # opfor generation radius away from objective
 OPFOR_GENERATE_RADIUS = 3  # type: int
 
@@ -15,19 +15,60 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 # A* path finding
-from math import fabs
+from heapq import heappop, heappush
+from itertools import count
+from math import inf
 
+from shared.constants import A_STAR, JUMP_POINT_SEARCH
+from simulation import jump_point_search
 from simulation.direction import Direction
 
 
 # shared constants and functions
-def manhattan_distance(from_location, to_location):
-    return fabs(from_location.x - to_location.x) + fabs(from_location.y - to_location.y)
+def octile_distance(from_location, to_location):
+    return jump_point_search.octile_distance(from_location.x, from_location.y, to_location.x, to_location.y)
+
+
+def step_cost(costs, my_map, from_location, to_location):
+    """Cost of one step: the terrain cost of the entered cell, scaled by the step length"""
+    adjusted_location = my_map.unoffset_point(to_location)
+    cost = float(costs[adjusted_location.x, adjusted_location.y])
+    if from_location.x != to_location.x and from_location.y != to_location.y:
+        return cost * jump_point_search.SQRT_2
+    return cost
 
 
 START = None
 END = None
 
+# algorithm used by find_path when the caller does not name one
+default_algorithm = A_STAR
+
+# most nodes an agent may expand per turn with BudgetedPathSearch; 0 means no limit
+node_budget = 0
+
+# weighted A* inflates the heuristic by this factor; paths cost at most this many times the
+# cheapest path, in exchange for far fewer node expansions (1.0 is plain A*)
+heuristic_weight = 1.0
+
+
+def set_default_algorithm(algorithm):
+    """Select the path finding algorithm for every find_path call that does not name one"""
+    global default_algorithm
+    default_algorithm = algorithm
+
+
+def set_node_budget(budget):
+    """Limit how many nodes agents expand per turn while path finding (0 for no limit)"""
+    global node_budget
+    node_budget = budget
+
+
+def set_heuristic_weight(weight):
+    """Select the weighted A* heuristic factor (epsilon) for every A* search"""
+    global heuristic_weight
+    heuristic_weight = weight
+
 
 def get_enterable_adjacent_locations(my_map, location):
     locations = []
@@ -39,33 +80,51 @@ def get_enterable_adjacent_locations(my_map, location):
     return locations
 
 
-# use A* algorithm to find a path 
-def find_path(my_map, from_location, to_location):
+# find a path with the requested algorithm (A* unless configured otherwise)
+# an unreachable to_location returns None without searching, or, when nearest_reachable
+# is set, the path ends at the reachable location closest to to_location instead
+def find_path(my_map, from_location, to_location, algorithm=None, nearest_reachable=False):
+    if not my_map.is_reachable(from_location, to_location):
+        if not nearest_reachable:
+            return None
+        to_location = my_map.nearest_reachable_location(from_location, to_location)
+        if to_location is None:
+            return None
+    if algorithm is None:
+        algorithm = default_algorithm
+    if algorithm == JUMP_POINT_SEARCH:
+        return jump_point_search.find_path(my_map, from_location, to_location)
+    return find_a_star_path(my_map, from_location, to_location)
+
+
+# use A* algorithm to find a path
+def find_a_star_path(my_map, from_location, to_location):
     from_node = Node(from_location, 0, 0, START)
-    to_node = Node(to_location, 0, 0, END)
+    to_key = location_key(to_location)
+    costs = my_map.movement_costs()
 
-    # open_list would be better as a priority queue, but
-    # python's heapq does not easily work with Node objects
+    # open_list is a binary heap of (cost, -movement_cost, sequence, node) entries:
+    # ties on cost prefer the deeper node, then the node that was pushed first.
+    # A better path to a location already on the heap is pushed as a new entry,
+    # and the stale entry is skipped when it is popped (lazy deletion)
     open_list = []
-    closed_list = []
+    best_movement_costs = {}
+    closed_set = set()
+    sequence = count()
 
-    open_list.append(from_node)
+    heappush(open_list, (from_node.cost, 0, next(sequence), from_node))
+    best_movement_costs[location_key(from_location)] = 0
 
     while len(open_list) > 0:
-        current_node = open_list[0]
-        current_index = 0
-        # find the lowest cost node in open_list
-        for index, node in enumerate(open_list):
-            if node.cost < current_node.cost:
-                current_node = node
-                current_index = index
-
-        # move lowest cost node from open list to closed list
-        open_list.pop(current_index)
-        closed_list.append(current_node)
+        # pop the lowest cost node from open_list
+        current_node = heappop(open_list)[3]
+        current_key = location_key(current_node.location)
+        if current_key in closed_set:
+            continue  # stale entry for a location that was already expanded more cheaply
+        closed_set.add(current_key)
 
         # if we have reached the goal, return the path
-        if current_node == to_node:
+        if current_key == to_key:
             path = []
             current = current_node
             while current is not START:
@@ -78,18 +137,100 @@ def find_path(my_map, from_location, to_location):
 
         # create nodes for the adjacent locations
         for adjacent_location in adjacent_locations:
+            adjacent_key = location_key(adjacent_location)
+            movement_cost = current_node.movement_cost + \
+                step_cost(costs, my_map, current_node.location, adjacent_location)
+            # selectively add the adjacent nodes to the open list
+            if adjacent_key in closed_set:
+                continue
+            if best_movement_costs.get(adjacent_key, inf) <= movement_cost:
+                continue
+            best_movement_costs[adjacent_key] = movement_cost
             adjacent_node = Node(adjacent_location,
-                                 current_node.movement_cost + 1,
-                                 manhattan_distance(adjacent_location, to_location),
+                                 movement_cost,
+                                 heuristic_weight * octile_distance(adjacent_location, to_location),
                                  current_node)
-
-            # selectively add the adjacent nodes to the open list
-            if adjacent_node in closed_list:
+            heappush(open_list, (adjacent_node.cost, -movement_cost, next(sequence), adjacent_node))
+
+
+class BudgetedPathSearch:
+    """A* search that expands at most budget nodes per call and picks up where it left off on the next call
+
+    Until the goal is reached, each call returns the path to the node closest to the
+    goal (lowest heuristic cost) found so far, so an agent can start moving right away."""
+    def __init__(self, from_location, to_location):
+        self.to_location = to_location
+        self.to_key = location_key(to_location)
+        from_node = Node(from_location, 0, heuristic_weight * octile_distance(from_location, to_location), START)
+        self.open_list = []
+        self.best_movement_costs = {location_key(from_location): 0}
+        self.closed_set = set()
+        self.sequence = count()
+        self.best_node = from_node
+        self.goal_node = None
+        self.exhausted = False
+        heappush(self.open_list, (from_node.cost, 0, next(self.sequence), from_node))
+
+    @property
+    def complete(self):
+        return self.goal_node is not None or self.exhausted
+
+    def expand(self, my_map, budget):
+        """Expand up to budget more nodes, reading neighbors from my_map"""
+        expanded_count = 0
+        costs = my_map.movement_costs()
+        while expanded_count < budget and not self.complete:
+            if len(self.open_list) == 0:
+                self.exhausted = True  # the goal cannot be reached; keep the closest node found
+                break
+            current_node = heappop(self.open_list)[3]
+            current_key = location_key(current_node.location)
+            if current_key in self.closed_set:
                 continue
-            for open_node in open_list:
-                if adjacent_node == open_node and adjacent_node.cost > open_node.cost:
+            self.closed_set.add(current_key)
+            expanded_count = expanded_count + 1
+            if current_key == self.to_key:
+                self.goal_node = current_node
+                break
+            if current_node.heuristic_cost < self.best_node.heuristic_cost:
+                self.best_node = current_node
+            for adjacent_location in get_enterable_adjacent_locations(my_map, current_node.location):
+                adjacent_key = location_key(adjacent_location)
+                movement_cost = current_node.movement_cost + \
+                    step_cost(costs, my_map, current_node.location, adjacent_location)
+                if adjacent_key in self.closed_set or \
+                        self.best_movement_costs.get(adjacent_key, inf) <= movement_cost:
                     continue
-            open_list.append(adjacent_node)
+                self.best_movement_costs[adjacent_key] = movement_cost
+                adjacent_node = Node(adjacent_location,
+                                     movement_cost,
+                                     heuristic_weight * octile_distance(adjacent_location, self.to_location),
+                                     current_node)
+                heappush(self.open_list, (adjacent_node.cost, -movement_cost, next(self.sequence), adjacent_node))
+
+    def best_path(self):
+        """Path from the start to the goal if it was found, otherwise to the node closest to the goal"""
+        current = self.goal_node if self.goal_node is not None else self.best_node
+        path = []
+        while current is not START:
+            path.append(current.location)
+            current = current.parent
+        return path[::-1]
+
+    def resume(self, my_map, location, budget):
+        """Spend another budget of expansions; return the best path trimmed to start at location,
+           or None if location has left the search tree and a new search is needed"""
+        self.expand(my_map, budget)
+        path = self.best_path()
+        for index, path_location in enumerate(path):
+            if path_location == location:
+                return path[index:]
+        return None
+
+
+def location_key(location):
+    """Hashable key for a location; Point itself is not hashable"""
+    return location.x, location.y
 
 
 class Node(object):
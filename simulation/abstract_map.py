@@ -16,58 +16,31 @@
 
 # map contains methods to create the elements that make up the simulated
 # map where the autonomous infantry squad operates
+import numpy
+
 from simulation.drawable import Drawable
-from simulation.grid import Grid
+from simulation.grid import Grid, OCCUPIED_BITS, OCCUPYING_DRAWABLES
+from simulation.point import Point
+from simulation.reachability import ReachabilityIndex
 
 
 class AbstractMap:
     # hash for quick lookup of occupied grid squares
-    occupied = {
-        Drawable.WARBOT_1: True,
-        Drawable.WARBOT_2: True,
-        Drawable.WARBOT_3: True,
-        Drawable.WARBOT_4: True,
-        Drawable.WARBOT_5: True,
-        Drawable.WARBOT_6: True,
-        Drawable.WARBOT_7: True,
-        Drawable.WARBOT_8: True,
-        Drawable.WARBOT_9: True,
-        Drawable.WARBOT_10: True,
-        Drawable.WARBOT_11: True,
-        Drawable.OPFOR_1: True,
-        Drawable.OPFOR_2: True,
-        Drawable.OPFOR_3: True,
-        Drawable.OPFOR_4: True,
-        Drawable.OPFOR_5: True,
-        Drawable.OPFOR_6: True,
-        Drawable.OPFOR_7: True,
-        Drawable.OPFOR_8: True,
-        Drawable.OPFOR_9: True,
-        Drawable.OPFOR_10: True,
-        Drawable.OPFOR_11: True,
-        Drawable.CIV_1: True,
-        Drawable.CIV_2: True,
-        Drawable.CIV_3: True,
-        Drawable.CIV_4: True,
-        Drawable.CIV_5: True,
-        Drawable.CIV_6: True,
-        Drawable.CIV_7: True,
-        Drawable.CIV_8: True,
-        Drawable.CIV_9: True,
-        Drawable.CIV_10: True,
-        Drawable.CIV_11: True,
-        Drawable.CIV_12: True,
-        Drawable.CIV_13: True,
-        Drawable.CIV_14: True,
-        Drawable.CIV_15: True,
-        Drawable.CIV_16: True,
-        Drawable.CIV_17: True,
-        Drawable.CIV_18: True,
-        Drawable.CIV_19: True,
-        Drawable.CIV_20: True,
-        Drawable.WATER: True
+    occupied = OCCUPYING_DRAWABLES
+
+    # cost of entering a cell for each kind of terrain; the costliest terrain in a cell applies
+    # and a cell without terrain costs 1.0 (the cheapest, so distance heuristics stay admissible)
+    terrain_costs = {
+        Drawable.DIRT: 1.0,
+        Drawable.GRASS: 1.0,
+        Drawable.TREE: 2.0,
+        Drawable.ROCK: 3.0,
+        Drawable.MUD: 4.0
     }
 
+    # bitmask of every Drawable in occupied
+    occupied_mask = OCCUPIED_BITS
+
     def __init__(self):
         self.grid = Grid()
         self.objective_location = None
@@ -75,6 +48,72 @@ class AbstractMap:
         self.rally_point_location = None
         self.warbot_locations = None
         self.civilian_locations = None
+        self.reachability = None
+        # bumped whenever terrain changes so cached route planning data can be discarded
+        self.terrain_version = 0
+        self.costs = None
+        self.costs_terrain_version = None
+
+    def unoffset_point(self, point):
+        return point
+
+    def offset_point(self, point):
+        return point
+
+    def get_agents_near_point(self, point, radius, prefix=None):
+        """Agent name -> location of every agent (whose name starts with prefix, if given)
+           no more than radius (straight line distance) from point"""
+        adjusted_point = self.unoffset_point(point)
+        agents = {}
+        for name, (x, y) in self.grid.entities_within(adjusted_point, radius):
+            if prefix is None or name.startswith(prefix):
+                agents[name] = self.offset_point(Point(x, y))
+        return agents
+
+    def reachability_index(self):
+        """Connected components of the navigable cells, built on first use"""
+        if self.reachability is None:
+            self.reachability = ReachabilityIndex(self.navigable_cells())
+        return self.reachability
+
+    def navigable_cells(self):
+        """Boolean array over the grid that is True where route planning may enter"""
+        return self.grid.navigable_mask()
+
+    def occupied_cells(self):
+        """Boolean array over the grid that is True where is_occupied would be True"""
+        return self.grid.occupied_mask()
+
+    def movement_costs(self):
+        """Array over the grid of the cost of entering each cell, rebuilt when the terrain changes"""
+        if self.costs is None or self.costs_terrain_version != self.terrain_version:
+            costs = numpy.ones((self.grid.width, self.grid.height))
+            for drawable, cost in AbstractMap.terrain_costs.items():
+                has_terrain = self.grid.mask_of([drawable])
+                costs[has_terrain] = numpy.maximum(costs[has_terrain], cost)
+            self.costs = costs
+            self.costs_terrain_version = self.terrain_version
+        return self.costs
 
+    def terrain_changed(self, point):
+        """Call after the terrain at point is rewritten so the reachability index stays current"""
+        self.terrain_version = self.terrain_version + 1
+        if self.reachability is not None:
+            adjusted_point = self.unoffset_point(point)
+            self.reachability.update(adjusted_point.x, adjusted_point.y, self.is_navigable(point))
 
+    def is_reachable(self, from_location, to_location):
+        from_point = self.unoffset_point(from_location)
+        to_point = self.unoffset_point(to_location)
+        return self.reachability_index().connected(from_point.x, from_point.y, to_point.x, to_point.y)
 
+    def nearest_reachable_location(self, from_location, to_location):
+        """to_location if it can be reached from from_location, otherwise the closest location that can be"""
+        from_point = self.unoffset_point(from_location)
+        to_point = self.unoffset_point(to_location)
+        nearest = self.reachability_index().nearest_reachable(from_point.x, from_point.y, to_point.x, to_point.y)
+        if nearest is None:
+            return None
+        if nearest == (to_point.x, to_point.y):
+            return to_location
+        return self.offset_point(Point(nearest[0], nearest[1]))
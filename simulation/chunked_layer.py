@@ -0,0 +1,182 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# chunked layer: a 2D grid layer stored as square numpy chunks
+#
+# Most of a big map's marker, agent and version layers hold the same value
+# everywhere.  A ChunkedLayer keeps one default value for the whole layer and
+# allocates a chunk only once a cell in it is set to something else, so memory
+# grows with the content of the map instead of its area.  It supports the few
+# array operations Grid needs: reading and writing single cells, reading a
+# rectangular window as a dense array, and numpy.asarray for the whole layer.
+#
+# A layer can instead be given a generate function, which it calls to fill in a
+# chunk the first time any cell in it is read.  Generated chunks that have not
+# been written since can be evicted to save memory; they are generated again,
+# with the same content, if they are read later.
+import numpy
+
+from shared.constants import GRID_CHUNK_SIZE
+
+
+class ChunkedLayer:
+    """width x height layer of dtype values, indexed as [x, y]
+
+    generate, when given, is called as generate(min_x, min_y, max_x, max_y) and returns the
+    dense values of those cells (inclusive) for a chunk that has not been read before."""
+    def __init__(self, width, height, dtype, default=0, chunk_size=GRID_CHUNK_SIZE, generate=None):
+        self.shape = (width, height)
+        self.dtype = numpy.dtype(dtype)
+        self.default = default
+        self.chunk_size = chunk_size
+        # (x // chunk_size, y // chunk_size) -> chunk_size x chunk_size array
+        self.chunks = {}
+        self.generate = generate
+        # keys of the chunks filled in by generate and not written since, which evict may drop
+        self.generated = set()
+
+    @classmethod
+    def from_array(cls, array, default=0, chunk_size=GRID_CHUNK_SIZE):
+        """Layer holding a copy of array, with chunks only where array differs from default"""
+        array = numpy.asarray(array)
+        layer = cls(array.shape[0], array.shape[1], array.dtype, default, chunk_size)
+        for chunk_x in range(0, array.shape[0], chunk_size):
+            for chunk_y in range(0, array.shape[1], chunk_size):
+                block = array[chunk_x:chunk_x + chunk_size, chunk_y:chunk_y + chunk_size]
+                if numpy.any(block != default):
+                    chunk = layer.allocate(chunk_x // chunk_size, chunk_y // chunk_size)
+                    chunk[:block.shape[0], :block.shape[1]] = block
+        return layer
+
+    def allocate(self, chunk_x, chunk_y):
+        chunk = numpy.full((self.chunk_size, self.chunk_size), self.default, self.dtype)
+        self.chunks[(chunk_x, chunk_y)] = chunk
+        return chunk
+
+    def chunk(self, chunk_x, chunk_y):
+        """The chunk at (chunk_x, chunk_y), generating it if need be; None where it holds only the default"""
+        chunk = self.chunks.get((chunk_x, chunk_y))
+        if chunk is None and self.generate is not None:
+            min_x = chunk_x * self.chunk_size
+            min_y = chunk_y * self.chunk_size
+            max_x = min(min_x + self.chunk_size, self.shape[0]) - 1
+            max_y = min(min_y + self.chunk_size, self.shape[1]) - 1
+            block = self.generate(min_x, min_y, max_x, max_y)
+            chunk = self.allocate(chunk_x, chunk_y)
+            chunk[:block.shape[0], :block.shape[1]] = block
+            self.generated.add((chunk_x, chunk_y))
+        return chunk
+
+    def generate_all(self):
+        """Generate every chunk not generated yet, for operations over the whole layer"""
+        if self.generate is None:
+            return
+        for chunk_x in range((self.shape[0] + self.chunk_size - 1) // self.chunk_size):
+            for chunk_y in range((self.shape[1] + self.chunk_size - 1) // self.chunk_size):
+                self.chunk(chunk_x, chunk_y)
+
+    def evict(self, keep):
+        """Drop the generated chunks that were not written since and for which keep(chunk_x, chunk_y)
+           is False; returns how many were dropped"""
+        evicted = [key for key in self.generated if not keep(key[0], key[1])]
+        for key in evicted:
+            del self.chunks[key]
+            self.generated.remove(key)
+        return len(evicted)
+
+    def fill(self, value):
+        """Set every cell to value, releasing every chunk"""
+        self.default = value
+        self.chunks.clear()
+        self.generated.clear()
+        self.generate = None
+
+    def window(self, min_x, min_y, max_x, max_y):
+        """Dense copy of the cells from (min_x, min_y) to (max_x, max_y) inclusive"""
+        window = numpy.full((max_x - min_x + 1, max_y - min_y + 1), self.default, self.dtype)
+        size = self.chunk_size
+        for chunk_x in range(min_x // size, max_x // size + 1):
+            for chunk_y in range(min_y // size, max_y // size + 1):
+                chunk = self.chunk(chunk_x, chunk_y)
+                if chunk is None:
+                    continue
+                low_x = max(min_x, chunk_x * size)
+                low_y = max(min_y, chunk_y * size)
+                high_x = min(max_x + 1, (chunk_x + 1) * size)
+                high_y = min(max_y + 1, (chunk_y + 1) * size)
+                window[low_x - min_x:high_x - min_x, low_y - min_y:high_y - min_y] = \
+                    chunk[low_x - chunk_x * size:high_x - chunk_x * size, low_y - chunk_y * size:high_y - chunk_y * size]
+        return window
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.window(0, 0, self.shape[0] - 1, self.shape[1] - 1)
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __getitem__(self, key):
+        x, y = key
+        if isinstance(x, slice) or isinstance(y, slice):
+            # slices (without steps) read a dense copy of the window
+            x_range = range(*(x if isinstance(x, slice) else slice(x, x + 1)).indices(self.shape[0]))
+            y_range = range(*(y if isinstance(y, slice) else slice(y, y + 1)).indices(self.shape[1]))
+            if len(x_range) == 0 or len(y_range) == 0:
+                return numpy.zeros((len(x_range), len(y_range)), self.dtype)
+            window = self.window(x_range[0], y_range[0], x_range[-1], y_range[-1])
+            return window if isinstance(x, slice) and isinstance(y, slice) else window.reshape(-1)
+        chunk = self.chunk(x // self.chunk_size, y // self.chunk_size)
+        if chunk is None:
+            return self.dtype.type(self.default)
+        return chunk[x % self.chunk_size, y % self.chunk_size]
+
+    def __setitem__(self, key, value):
+        x, y = key
+        chunk_key = (x // self.chunk_size, y // self.chunk_size)
+        chunk = self.chunk(chunk_key[0], chunk_key[1])
+        if chunk is None:
+            if value == self.default:
+                return
+            chunk = self.allocate(chunk_key[0], chunk_key[1])
+        elif chunk[x % self.chunk_size, y % self.chunk_size] == value:
+            return
+        chunk[x % self.chunk_size, y % self.chunk_size] = value
+        # a written chunk can no longer be generated again, so it is kept
+        self.generated.discard(chunk_key)
+
+    def clipped_chunks(self):
+        """(x, y, view) of every allocated chunk, with the view clipped to the layer's edges"""
+        self.generate_all()
+        for (chunk_x, chunk_y), chunk in self.chunks.items():
+            x = chunk_x * self.chunk_size
+            y = chunk_y * self.chunk_size
+            yield x, y, chunk[:self.shape[0] - x, :self.shape[1] - y]
+
+    def bits_set(self, mask):
+        """Dense boolean array that is True where a cell has any bit of mask set"""
+        matching = numpy.full(self.shape, int(self.default) & mask != 0, bool)
+        for x, y, chunk in self.clipped_chunks():
+            matching[x:x + chunk.shape[0], y:y + chunk.shape[1]] = numpy.bitwise_and(chunk, self.dtype.type(mask)) != 0
+        return matching
+
+    def cells_above(self, value):
+        """List of (x, y) of every cell holding more than value, ordered by x, then y"""
+        if self.default > value:
+            xs, ys = numpy.nonzero(numpy.asarray(self) > value)
+            return list(zip(xs.tolist(), ys.tolist()))
+        cells = []
+        for x, y, chunk in self.clipped_chunks():
+            xs, ys = numpy.nonzero(chunk > value)
+            cells.extend(zip((xs + x).tolist(), (ys + y).tolist()))
+        cells.sort()
+        return cells
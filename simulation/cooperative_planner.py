@@ -0,0 +1,159 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# cooperative path planning (windowed hierarchical cooperative A*, WHCA*)
+#
+# Agents pick their moves independently, so two of them can ask for the same cell,
+# or swap cells, in the same turn.  Each turn the simulation plans every requested
+# move against a shared space-time reservation table: agents take turns, in
+# priority order, searching (x, y, t) space over a short window and reserving the
+# cells they will occupy.  Only the first step of each plan is carried out, and
+# the window slides forward on the next turn.
+from heapq import heappop, heappush
+from itertools import count
+
+from shared.constants import COOPERATIVE_PLANNING_WINDOW
+from simulation.direction import Direction
+from simulation.point import Point
+
+# staying put is a legal move in space-time search
+MOVE_VECTORS = [(0, 0)] + [direction.value for direction in Direction]
+
+
+def chebyshev_distance(from_cell, to_cell):
+    return max(abs(from_cell[0] - to_cell[0]), abs(from_cell[1] - to_cell[1]))
+
+
+class ReservationTable:
+    """Which agent holds each cell at each time step of the planning window"""
+    def __init__(self):
+        self.cells = {}
+        self.edges = set()
+
+    def reserve_cell(self, cell, time, agent_name):
+        self.cells[(cell[0], cell[1], time)] = agent_name
+
+    def release_cell(self, cell, time):
+        self.cells.pop((cell[0], cell[1], time), None)
+
+    def reserve_move(self, from_cell, to_cell, time):
+        self.edges.add((from_cell, to_cell, time))
+
+    def is_free(self, cell, time, agent_name):
+        return self.cells.get((cell[0], cell[1], time), agent_name) == agent_name
+
+    def is_swap(self, from_cell, to_cell, time):
+        """True if another agent already moves from to_cell into from_cell during this step"""
+        return (to_cell, from_cell, time) in self.edges
+
+
+class CooperativePlanner:
+    """Turns the moves agents request for a turn into moves that do not collide"""
+    def __init__(self, mission_map, window=COOPERATIVE_PLANNING_WINDOW):
+        self.mission_map = mission_map
+        self.window = window
+        # agents that did not get their requested move go first next turn
+        self.delayed_agents = set()
+
+    def agent_locations(self):
+        locations = {}
+        for agent_locations in [self.mission_map.warbot_locations, self.mission_map.opfor_locations,
+                                self.mission_map.civilian_locations]:
+            if agent_locations is not None:
+                locations.update(agent_locations)
+        return locations
+
+    def can_enter(self, cell):
+        return self.mission_map.can_enter_route_plan(Point(cell[0], cell[1]))
+
+    def space_time_search(self, reservations, agent_name, start, goal):
+        """Cells at t = 0 .. window that move agent_name toward goal without a conflict"""
+        sequence = count()
+        start_state = (start, 0)
+        parents = {start_state: None}
+        open_list = [(chebyshev_distance(start, goal), 0, next(sequence), start_state)]
+        best_state = start_state
+        best_score = (chebyshev_distance(start, goal), 0)
+        while len(open_list) > 0:
+            _, elapsed, _, state = heappop(open_list)
+            cell, time = state
+            score = (chebyshev_distance(cell, goal), elapsed)
+            if cell == goal:
+                best_state = state
+                break
+            if score < best_score:
+                best_state = state
+                best_score = score
+            if time == self.window:
+                continue
+            for vector_x, vector_y in MOVE_VECTORS:
+                next_cell = (cell[0] + vector_x, cell[1] + vector_y)
+                next_state = (next_cell, time + 1)
+                if next_state in parents:
+                    continue
+                if next_cell != cell and not self.can_enter(next_cell):
+                    continue
+                if not reservations.is_free(next_cell, time + 1, agent_name) or \
+                        reservations.is_swap(cell, next_cell, time):
+                    continue
+                parents[next_state] = state
+                heappush(open_list, (elapsed + 1 + chebyshev_distance(next_cell, goal),
+                                     elapsed + 1, next(sequence), next_state))
+        # walk back from the best state to recover the cell held at each time step
+        cells = []
+        state = best_state
+        while state is not None:
+            cells.append(state[0])
+            state = parents[state]
+        return cells[::-1]
+
+    def plan_moves(self, requested_moves):
+        """Map each agent name in requested_moves (agent name -> Point) to the Point it may move to"""
+        locations = self.agent_locations()
+        reservations = ReservationTable()
+        # agents that are not moving hold their cells for the whole window
+        for agent_name, location in locations.items():
+            if agent_name not in requested_moves:
+                for time in range(self.window + 1):
+                    reservations.reserve_cell((location.x, location.y), time, agent_name)
+        # moving agents may not leave in time for anyone to step into their cells until they have planned
+        for agent_name in requested_moves:
+            location = locations[agent_name]
+            reservations.reserve_cell((location.x, location.y), 0, agent_name)
+            reservations.reserve_cell((location.x, location.y), 1, agent_name)
+        ordered_agents = sorted(requested_moves.keys(),
+                                key=lambda agent_name: (agent_name not in self.delayed_agents, agent_name))
+        moves = {}
+        self.delayed_agents = set()
+        for agent_name in ordered_agents:
+            location = locations[agent_name]
+            start = (location.x, location.y)
+            goal = (requested_moves[agent_name].x, requested_moves[agent_name].y)
+            cells = self.space_time_search(reservations, agent_name, start, goal)
+            # reserve the planned cells, then the final cell for the rest of the window
+            for time, cell in enumerate(cells):
+                reservations.reserve_cell(cell, time, agent_name)
+                if time > 0:
+                    reservations.reserve_move(cells[time - 1], cell, time - 1)
+            for time in range(len(cells), self.window + 1):
+                reservations.reserve_cell(cells[-1], time, agent_name)
+            next_cell = cells[1] if len(cells) > 1 else start
+            if next_cell != start:
+                reservations.release_cell(start, 1)
+            if next_cell != goal:
+                self.delayed_agents.add(agent_name)
+            moves[agent_name] = Point(next_cell[0], next_cell[1])
+        return moves
@@ -0,0 +1,203 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# D* Lite incremental path planning
+#
+# A warbot keeps one planner across turns.  The planner searches backward from
+# the goal in mission map coordinates and remembers which cells it has seen
+# blocked (water, or occupied by another agent).  Each turn it compares what the
+# visible map shows against what it remembers and only repairs the part of the
+# search tree that the changed cells affect, instead of searching from scratch.
+# Cells the warbot has never seen are assumed to be open.
+from heapq import heappop, heappush
+from itertools import count
+from math import inf
+
+import numpy
+
+from shared.constants import WARBOT_VISION_DISTANCE
+from simulation.direction import Direction
+from simulation.point import Point
+
+NEIGHBOR_VECTORS = [direction.value for direction in Direction]
+
+
+def chebyshev_distance(from_cell, to_cell):
+    return max(abs(from_cell[0] - to_cell[0]), abs(from_cell[1] - to_cell[1]))
+
+
+class DStarLitePlanner:
+    """Incremental planner that repairs its previous search when a few cells change"""
+    def __init__(self, map_width, map_height, margin=WARBOT_VISION_DISTANCE):
+        # size of the mission map; the search never leaves it
+        self.map_width = map_width
+        self.map_height = map_height
+        # how far past the start and goal the search may wander
+        self.margin = margin
+        self.goal = None
+        self.start = None
+        self.last_start = None
+        self.key_modifier = 0
+        self.g = {}
+        self.rhs = {}
+        self.open_list = []
+        self.open_keys = {}
+        self.sequence = count()
+        self.blocked = set()
+        self.bounds = None
+        self.expanded_count = 0
+
+    def reset(self, start, goal):
+        self.goal = goal
+        self.start = start
+        self.last_start = start
+        self.key_modifier = 0
+        self.g = {}
+        self.rhs = {goal: 0}
+        self.open_list = []
+        self.open_keys = {}
+        self.blocked = set()
+        # cells off the map are never seen blocked, so the bounds must not reach past its edges
+        self.bounds = (max(min(start[0], goal[0]) - self.margin, 0),
+                       max(min(start[1], goal[1]) - self.margin, 0),
+                       min(max(start[0], goal[0]) + self.margin, self.map_width - 1),
+                       min(max(start[1], goal[1]) + self.margin, self.map_height - 1))
+        self.push(goal)
+
+    def in_bounds(self, cell):
+        min_x, min_y, max_x, max_y = self.bounds
+        return min_x <= cell[0] <= max_x and min_y <= cell[1] <= max_y
+
+    def passable(self, cell):
+        return self.in_bounds(cell) and cell not in self.blocked
+
+    def neighbors(self, cell):
+        x, y = cell
+        return [(x + vector_x, y + vector_y) for vector_x, vector_y in NEIGHBOR_VECTORS]
+
+    def cost(self, from_cell, to_cell):
+        if self.passable(from_cell) and self.passable(to_cell):
+            return 1
+        return inf
+
+    def calculate_key(self, cell):
+        best = min(self.g.get(cell, inf), self.rhs.get(cell, inf))
+        return best + chebyshev_distance(self.start, cell) + self.key_modifier, best
+
+    def push(self, cell):
+        key = self.calculate_key(cell)
+        self.open_keys[cell] = key
+        heappush(self.open_list, (key, next(self.sequence), cell))
+
+    def top_key(self):
+        # discard entries that were removed or re-keyed since they were pushed (lazy deletion)
+        while len(self.open_list) > 0:
+            key, _, cell = self.open_list[0]
+            if self.open_keys.get(cell) == key:
+                return key
+            heappop(self.open_list)
+        return inf, inf
+
+    def update_vertex(self, cell):
+        if cell != self.goal:
+            best = inf
+            if self.passable(cell):
+                for neighbor in self.neighbors(cell):
+                    best = min(best, self.cost(cell, neighbor) + self.g.get(neighbor, inf))
+            self.rhs[cell] = best
+        self.open_keys.pop(cell, None)
+        if self.g.get(cell, inf) != self.rhs.get(cell, inf):
+            self.push(cell)
+
+    def compute_shortest_path(self):
+        while self.top_key() < self.calculate_key(self.start) or \
+                self.rhs.get(self.start, inf) != self.g.get(self.start, inf):
+            old_key = self.top_key()
+            if old_key == (inf, inf):
+                return  # the open list is exhausted: the goal cannot be reached
+            _, _, cell = heappop(self.open_list)
+            del self.open_keys[cell]
+            self.expanded_count += 1
+            new_key = self.calculate_key(cell)
+            if old_key < new_key:
+                self.push(cell)
+            elif self.g.get(cell, inf) > self.rhs.get(cell, inf):
+                self.g[cell] = self.rhs[cell]
+                for neighbor in self.neighbors(cell):
+                    if self.in_bounds(neighbor):
+                        self.update_vertex(neighbor)
+            else:
+                self.g[cell] = inf
+                self.update_vertex(cell)
+                for neighbor in self.neighbors(cell):
+                    if self.in_bounds(neighbor):
+                        self.update_vertex(neighbor)
+
+    def sense(self, my_map, start):
+        """Cells on the visible map whose blocked state differs from what the planner remembers"""
+        origin = my_map.offset_point(Point(0, 0))
+        window_blocked = numpy.logical_or(numpy.logical_not(my_map.navigable_cells()), my_map.occupied_cells())
+        width, height = window_blocked.shape
+        seen_blocked = set((origin.x + int(x), origin.y + int(y)) for x, y in zip(*numpy.nonzero(window_blocked)))
+        # the planner's own agent and the goal never block the route
+        seen_blocked.discard(start)
+        seen_blocked.discard(self.goal)
+        changed = seen_blocked - self.blocked
+        for cell in self.blocked:
+            if origin.x <= cell[0] < origin.x + width and origin.y <= cell[1] < origin.y + height \
+                    and cell not in seen_blocked:
+                changed.add(cell)
+        return changed
+
+    def extract_path(self):
+        if self.g.get(self.start, inf) == inf:
+            return None
+        path = [Point(self.start[0], self.start[1])]
+        cell = self.start
+        visited = {cell}
+        while cell != self.goal:
+            cell = min(self.neighbors(cell), key=lambda neighbor: self.cost(cell, neighbor) + self.g.get(neighbor, inf))
+            if cell in visited or self.g.get(cell, inf) == inf:
+                return None
+            visited.add(cell)
+            path.append(Point(cell[0], cell[1]))
+        return path
+
+    def plan(self, my_map, from_location, to_location):
+        """Path from from_location to to_location in the same form as a_star.find_path, or None"""
+        start = (from_location.x, from_location.y)
+        goal = (to_location.x, to_location.y)
+        if goal != self.goal or not self.in_bounds(start):
+            self.reset(start, goal)
+        else:
+            # the start moved: keep the old keys valid by raising the key modifier
+            self.key_modifier = self.key_modifier + chebyshev_distance(self.last_start, start)
+            self.last_start = start
+            self.start = start
+        changed = self.sense(my_map, start)
+        for cell in changed:
+            if cell in self.blocked:
+                self.blocked.remove(cell)
+            else:
+                self.blocked.add(cell)
+        for cell in changed:
+            if self.in_bounds(cell):
+                self.update_vertex(cell)
+                for neighbor in self.neighbors(cell):
+                    if self.in_bounds(neighbor):
+                        self.update_vertex(neighbor)
+        self.compute_shortest_path()
+        return self.extract_path()
@@ -0,0 +1,92 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# entity registry: integer IDs for the agents on a grid
+#
+# Drawable gives each agent its own bit of a uint64, which caps a map at 11
+# warbots, 11 OPFOR and 20 civilians.  The registry instead numbers agents as
+# they are placed, so a grid can hold any number of them.  Agents that also have
+# a Drawable keep their bit in the packed array for rendering and old readers.
+from shared.constants import CIVILIAN_PREFIX, OPFOR_PREFIX, WARBOT_PREFIX
+from simulation.drawable import Drawable
+
+# agent types, named by their name prefix, and the Drawable whose color each type is drawn with
+TYPE_DRAWABLES = {
+    WARBOT_PREFIX: Drawable.WARBOT_1,
+    OPFOR_PREFIX: Drawable.OPFOR_1,
+    CIVILIAN_PREFIX: Drawable.CIV_1
+}
+
+
+def entity_type(name):
+    """WARBOT_PREFIX, OPFOR_PREFIX or CIVILIAN_PREFIX for an agent name, or None"""
+    for prefix in TYPE_DRAWABLES:
+        if name.startswith(prefix):
+            return prefix
+    return None
+
+
+def entity_drawable(name):
+    """The Drawable of an agent that has one, or None for agents past the Drawable range"""
+    return Drawable.__members__.get(name)
+
+
+def entity_color(name):
+    return TYPE_DRAWABLES[entity_type(name)].color
+
+
+class EntityRegistry:
+    """Integer IDs for agent names, with the cell each agent is in"""
+    def __init__(self):
+        # ID -> name
+        self.names = []
+        self.ids = {}
+        # ID -> (x, y), or None while the agent is not on the grid
+        self.locations = []
+
+    def clear(self):
+        """Forget every agent, keeping the containers for reuse"""
+        del self.names[:]
+        self.ids.clear()
+        del self.locations[:]
+
+    def register(self, name):
+        """ID for name, assigned the first time name is seen"""
+        entity_id = self.ids.get(name)
+        if entity_id is None:
+            entity_id = len(self.names)
+            self.names.append(name)
+            self.ids[name] = entity_id
+            self.locations.append(None)
+        return entity_id
+
+    def id_of(self, name):
+        return self.ids.get(name)
+
+    def name_of(self, entity_id):
+        return self.names[entity_id]
+
+    def location_of(self, name):
+        entity_id = self.ids.get(name)
+        if entity_id is None:
+            return None
+        return self.locations[entity_id]
+
+    def placed(self):
+        """(name, (x, y)) of every agent on the grid, ordered by x, then y, then ID"""
+        placed = [(location, entity_id) for entity_id, location in enumerate(self.locations) if location is not None]
+        placed.sort()
+        return [(self.names[entity_id], location) for location, entity_id in placed]
@@ -0,0 +1,112 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# flow field (Dijkstra map) toward a single goal
+#
+# The simulation computes one field per goal over the whole mission map.  Every
+# warbot heading to that goal then reads its next step from the field instead of
+# running its own search.
+from math import sqrt
+
+import numpy
+
+from simulation.direction import Direction
+from simulation.point import Point
+
+NEIGHBOR_VECTORS = [direction.value for direction in Direction]
+# length of a step toward each neighbor: diagonal steps are longer
+NEIGHBOR_STEP_LENGTHS = [sqrt(2) if vector[0] != 0 and vector[1] != 0 else 1.0 for vector in NEIGHBOR_VECTORS]
+
+
+def neighbor_values(padded, vector, width, height):
+    """View of padded (a field with a one cell border) holding each cell's neighbor in direction vector"""
+    return padded[1 + vector[0]:1 + vector[0] + width, 1 + vector[1]:1 + vector[1] + height]
+
+
+class FlowField:
+    """Steps to goal from every navigable cell of a 2D boolean array indexed as [x][y]
+
+    costs, when given, is an array of the same shape holding the cost of entering each cell
+    (see AbstractMap.movement_costs); without it every cell costs 1.0."""
+    def __init__(self, navigable, goal, costs=None):
+        self.goal = goal
+        self.width = navigable.shape[0]
+        self.height = navigable.shape[1]
+        self.distances = numpy.full((self.width, self.height), numpy.inf)
+        # index into NEIGHBOR_VECTORS of the next step toward goal; -1 at the goal and where it is unreachable
+        self.next_directions = numpy.full((self.width, self.height), -1, numpy.int8)
+        if self.on_field(goal.x, goal.y) and navigable[goal.x, goal.y]:
+            self.compute(navigable, costs)
+
+    def on_field(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def compute(self, navigable, costs):
+        width = self.width
+        height = self.height
+        blocked = numpy.logical_not(navigable)
+        padded_costs = numpy.full((width + 2, height + 2), numpy.inf)
+        padded_costs[1:-1, 1:-1] = 1.0 if costs is None else costs
+        # cost of the step from each cell into its neighbor in each direction
+        step_costs = [neighbor_values(padded_costs, vector, width, height) * length
+                      for vector, length in zip(NEIGHBOR_VECTORS, NEIGHBOR_STEP_LENGTHS)]
+        padded = numpy.full((width + 2, height + 2), numpy.inf)
+        distances = padded[1:-1, 1:-1]
+        distances[self.goal.x, self.goal.y] = 0
+        # relax every cell against all 8 neighbors at once until the wavefront stops moving
+        while True:
+            best_neighbor = numpy.minimum.reduce([neighbor_values(padded, vector, width, height) + step_cost
+                                                  for vector, step_cost in zip(NEIGHBOR_VECTORS, step_costs)])
+            relaxed = numpy.minimum(distances, best_neighbor)
+            relaxed[blocked] = numpy.inf
+            if numpy.array_equal(relaxed, distances):
+                break
+            distances[:] = relaxed
+        self.distances = distances.copy()
+        # the next step from each cell is the neighbor that is cheapest to reach the goal through
+        neighbor_distances = numpy.stack([neighbor_values(padded, vector, width, height) + step_cost
+                                          for vector, step_cost in zip(NEIGHBOR_VECTORS, step_costs)])
+        self.next_directions = numpy.argmin(neighbor_distances, axis=0).astype(numpy.int8)
+        self.next_directions[numpy.isinf(self.distances)] = -1
+        self.next_directions[self.goal.x, self.goal.y] = -1
+
+    def distance(self, location):
+        if self.on_field(location.x, location.y):
+            return self.distances[location.x, location.y]
+        return numpy.inf
+
+    def is_reachable(self, location):
+        return not numpy.isinf(self.distance(location))
+
+    def next_step(self, location):
+        """Next location toward the goal, or None at the goal or where the goal is unreachable"""
+        if not self.on_field(location.x, location.y):
+            return None
+        direction = self.next_directions[location.x, location.y]
+        if direction < 0:
+            return None
+        return location.plus_vector(NEIGHBOR_VECTORS[direction])
+
+    def path_from(self, location):
+        """Path from location to the goal in the same form as a_star.find_path, or None if unreachable"""
+        if not self.is_reachable(location):
+            return None
+        path = [Point(location.x, location.y)]
+        next_location = self.next_step(location)
+        while next_location is not None:
+            path.append(next_location)
+            next_location = self.next_step(next_location)
+        return path
@@ -16,36 +16,367 @@
 import numpy
 
 from graphics.pygame_constants import CELL_SIZE, WINDOW_HEIGHT, WINDOW_WIDTH
+from simulation.chunked_layer import ChunkedLayer
 from simulation.drawable import Drawable
+from simulation.entity_registry import EntityRegistry, entity_drawable, entity_type
+from simulation.point import Point
+from simulation.spatial_hash import SpatialHash
+
+
+def bit_drawables():
+    """Table of the Drawable held by each bit position of a cell value"""
+    table = [None] * 64
+    for drawable in Drawable:
+        if drawable.value != 0:
+            table[drawable.value.bit_length() - 1] = drawable
+    return table
+
+
+# lets __getitem__ decode only the bits that are set
+BIT_DRAWABLES = bit_drawables()
+
+# drawables that keep agents out of a cell
+OCCUPYING_DRAWABLES = {
+    Drawable.WARBOT_1: True,
+    Drawable.WARBOT_2: True,
+    Drawable.WARBOT_3: True,
+    Drawable.WARBOT_4: True,
+    Drawable.WARBOT_5: True,
+    Drawable.WARBOT_6: True,
+    Drawable.WARBOT_7: True,
+    Drawable.WARBOT_8: True,
+    Drawable.WARBOT_9: True,
+    Drawable.WARBOT_10: True,
+    Drawable.WARBOT_11: True,
+    Drawable.OPFOR_1: True,
+    Drawable.OPFOR_2: True,
+    Drawable.OPFOR_3: True,
+    Drawable.OPFOR_4: True,
+    Drawable.OPFOR_5: True,
+    Drawable.OPFOR_6: True,
+    Drawable.OPFOR_7: True,
+    Drawable.OPFOR_8: True,
+    Drawable.OPFOR_9: True,
+    Drawable.OPFOR_10: True,
+    Drawable.OPFOR_11: True,
+    Drawable.CIV_1: True,
+    Drawable.CIV_2: True,
+    Drawable.CIV_3: True,
+    Drawable.CIV_4: True,
+    Drawable.CIV_5: True,
+    Drawable.CIV_6: True,
+    Drawable.CIV_7: True,
+    Drawable.CIV_8: True,
+    Drawable.CIV_9: True,
+    Drawable.CIV_10: True,
+    Drawable.CIV_11: True,
+    Drawable.CIV_12: True,
+    Drawable.CIV_13: True,
+    Drawable.CIV_14: True,
+    Drawable.CIV_15: True,
+    Drawable.CIV_16: True,
+    Drawable.CIV_17: True,
+    Drawable.CIV_18: True,
+    Drawable.CIV_19: True,
+    Drawable.CIV_20: True,
+    Drawable.WATER: True
+}
+
+# bitmask of every Drawable in OCCUPYING_DRAWABLES (each value is a distinct bit)
+OCCUPIED_BITS = sum(drawable.value for drawable in OCCUPYING_DRAWABLES)
+
+# The grid is stored in layers instead of one uint64 per cell:
+#   terrain: uint8 per cell, bit i set when the cell holds TERRAIN_DRAWABLES[i]
+#   markers: uint8 per cell, bit i set when the cell holds MARKER_DRAWABLES[i]
+#   entities: an agent count per cell, a SpatialHash of the agent IDs in the few cells that
+#             hold agents, and an EntityRegistry with the name and cell of each agent
+# The packed uint64 value of a cell (the OR of its Drawable values) is still what
+# __getitem__ decodes and what the array property returns for rendering and messages.
+TERRAIN_DRAWABLES = [Drawable.WATER, Drawable.MUD, Drawable.DIRT, Drawable.GRASS,
+                     Drawable.TREE, Drawable.ROCK, Drawable.DOOR, Drawable.WALL]
+# the terrain drawables hold 8 consecutive bits, so a terrain layer value is a shifted slice of the packed value
+TERRAIN_SHIFT = Drawable.WATER.value.bit_length() - 1
+TERRAIN_BITS = 0xFF << TERRAIN_SHIFT
+WATER_TERRAIN_BIT = 1 << TERRAIN_DRAWABLES.index(Drawable.WATER)
+MARKER_DRAWABLES = [Drawable.BULLET, Drawable.GRENADE, Drawable.FIRE, Drawable.RALLY_POINT, Drawable.OBJECTIVE]
+MARKER_BITS = sum(drawable.value for drawable in MARKER_DRAWABLES)
+# bits of the agents that have a Drawable; every agent, with or without one, lives in the entity layer
+ENTITY_BITS = sum(drawable.value for drawable in Drawable if entity_type(drawable.name) is not None)
+
+
+def terrain_layer_value(drawable):
+    """Terrain layer value of a cell holding only the terrain drawable"""
+    return 1 << TERRAIN_DRAWABLES.index(drawable)
+
+
+def marker_layer_value(value):
+    """Marker layer value for the marker bits of a packed value"""
+    layer_value = 0
+    for index, drawable in enumerate(MARKER_DRAWABLES):
+        if value & drawable.value != 0:
+            layer_value = layer_value | (1 << index)
+    return layer_value
+
+
+# packed value of every marker layer value
+MARKER_VALUES = [sum(drawable.value for index, drawable in enumerate(MARKER_DRAWABLES) if layer_value & (1 << index))
+                 for layer_value in range(2 ** len(MARKER_DRAWABLES))]
+
+
+# keys of the layers Grid.reserve preallocates
+TERRAIN = "terrain"
+MARKERS = "markers"
+ENTITY_COUNTS = "entity_counts"
+CELL_VERSIONS = "cell_versions"
+SCRATCH = "scratch"
+
+
+def bits_set(layer, mask):
+    """Boolean array over a dense or chunked layer that is True where a cell has any bit of mask set"""
+    if isinstance(layer, ChunkedLayer):
+        return layer.bits_set(mask)
+    return numpy.bitwise_and(layer, layer.dtype.type(mask)) != 0
+
+
+def set_bits(value):
+    """The set bits of value, lowest first, as single-bit ints"""
+    bits = []
+    while value != 0:
+        lowest_bit = value & -value
+        bits.append(lowest_bit)
+        value = value ^ lowest_bit
+    return bits
 
 
 class Grid:
     def __init__(self):
-        self.all_drawables = list(Drawable.__members__)
         self.width = None
         self.height = None
-        self.array = None
+        self.terrain = None
+        self.markers = None
+        self.entity_counts = None
+        # IDs of the agents in each cell, and in each bucket of cells for range queries
+        self.spatial_hash = SpatialHash()
+        self.entities = EntityRegistry()
+        # packed uint64 array, built on first use and then kept current by every write
+        self.packed = None
+        # bumped by every write; each cell records the version of the last write to it, so
+        # renderers, encoders and caches can each ask what changed since the version they last saw
+        self.version = 0
+        self.cell_versions = None
+        # layers preallocated by reserve, which grids that fit inside are views of
+        self.reserved = None
+        # True when the layers are ChunkedLayers (the mission map) rather than dense arrays (visible maps)
+        self.chunked = False
+
+    def reserve(self, width, height):
+        """Preallocate layers big enough for any grid up to width x height, so that importing
+           arrays that fit (such as an agent's visible map each turn) reuses them"""
+        self.reserved = {TERRAIN: numpy.zeros((width, height), numpy.uint8),
+                         MARKERS: numpy.zeros((width, height), numpy.uint8),
+                         ENTITY_COUNTS: numpy.zeros((width, height), numpy.uint16),
+                         CELL_VERSIONS: numpy.zeros((width, height), numpy.uint64),
+                         SCRATCH: numpy.zeros((width, height), numpy.uint64)}
+
+    def fits_reserved(self):
+        return self.reserved is not None and self.width <= self.reserved[TERRAIN].shape[0] and \
+            self.height <= self.reserved[TERRAIN].shape[1]
 
-    def default_grid(self):
-        """create the default grid used for the simulation"""
-        self.width = int(WINDOW_WIDTH / CELL_SIZE)
-        self.height = int(WINDOW_HEIGHT / CELL_SIZE)
+    def reserved_layer(self, layer):
+        view = self.reserved[layer][:self.width, :self.height]
+        view.fill(0)
+        return view
+
+    def create_layers(self):
+        if self.chunked:
+            self.terrain = ChunkedLayer(self.width, self.height, numpy.uint8)
+            self.markers = ChunkedLayer(self.width, self.height, numpy.uint8)
+            self.entity_counts = ChunkedLayer(self.width, self.height, numpy.uint16)
+            self.cell_versions = ChunkedLayer(self.width, self.height, numpy.uint64)
+        elif self.fits_reserved():
+            self.terrain = self.reserved_layer(TERRAIN)
+            self.markers = self.reserved_layer(MARKERS)
+            self.entity_counts = self.reserved_layer(ENTITY_COUNTS)
+            self.cell_versions = self.reserved_layer(CELL_VERSIONS)
+        else:
+            self.terrain = numpy.zeros((self.width, self.height), numpy.uint8)
+            self.markers = numpy.zeros((self.width, self.height), numpy.uint8)
+            self.entity_counts = numpy.zeros((self.width, self.height), numpy.uint16)
+            self.cell_versions = numpy.zeros((self.width, self.height), numpy.uint64)
+        self.spatial_hash.clear()
+        self.entities.clear()
+        self.packed = None
+        # every cell is new; the version keeps counting up so older versions still compare as stale
+        self.mark_all_changed()
+
+    def default_grid(self, width=None, height=None):
+        """create the default grid used for the simulation; without a width and height it fills the window"""
+        self.width = width if width is not None else int(WINDOW_WIDTH / CELL_SIZE)
+        self.height = height if height is not None else int(WINDOW_HEIGHT / CELL_SIZE)
+        # the world can be much bigger than the window, so its layers only hold chunks with content
+        self.chunked = True
         # create grid
-        self.array = numpy.zeros((self.width, self.height), numpy.uint64)
+        self.create_layers()
+
+    def import_array(self, array, entities=None):
+        """import an array to represent a portion of the map visible to a warbot or opfor;
+           entities is a list of [name, x, y] for agents in the array, including any without a Drawable"""
+        # a uint64 array (such as a SharedGrid window) is read in place rather than copied
+        packed = numpy.asarray(array, numpy.uint64)
+        self.width = packed.shape[0]
+        self.height = packed.shape[1]
+        self.chunked = False
+        self.create_layers()
+        # ufuncs write into existing arrays so that a reserved grid allocates no new layers
+        if self.fits_reserved():
+            scratch = self.reserved[SCRATCH][:self.width, :self.height]
+        else:
+            scratch = numpy.empty((self.width, self.height), numpy.uint64)
+        numpy.right_shift(packed, numpy.uint64(TERRAIN_SHIFT), out=scratch)
+        numpy.copyto(self.terrain, scratch, casting='unsafe')
+        for index, drawable in enumerate(MARKER_DRAWABLES):
+            # move the marker's bit down to its bit in the marker layer
+            numpy.bitwise_and(packed, numpy.uint64(drawable.value), out=scratch)
+            numpy.right_shift(scratch, numpy.uint64(drawable.value.bit_length() - 1 - index), out=scratch)
+            numpy.bitwise_or(self.markers, scratch, out=self.markers, casting='unsafe')
+        numpy.bitwise_and(packed, numpy.uint64(ENTITY_BITS), out=scratch)
+        xs, ys = numpy.nonzero(scratch)
+        for x, y, value in zip(xs.tolist(), ys.tolist(), scratch[xs, ys].tolist()):
+            for bit in set_bits(value):
+                self.move_entity(BIT_DRAWABLES[bit.bit_length() - 1].name, Point(x, y))
+        if entities is not None:
+            for name, x, y in entities:
+                self.move_entity(name, Point(x, y))
+        # a read-only view cannot be kept current by writes, so it is rebuilt from the layers when needed
+        self.packed = packed if packed.flags.writeable else None
+
+    @property
+    def array(self):
+        """Packed uint64 array with the OR of the Drawable values in each cell, as used for rendering and messages"""
+        if self.chunked:
+            # a whole world may not fit in memory as one packed array, so it is never kept
+            return self.window(0, 0, self.width - 1, self.height - 1)
+        if self.packed is None:
+            self.packed = self.window(0, 0, self.width - 1, self.height - 1)
+        return self.packed
+
+    def window(self, min_x, min_y, max_x, max_y):
+        """Packed values of the cells from (min_x, min_y) to (max_x, max_y) inclusive"""
+        if self.packed is not None:
+            return self.packed[min_x:max_x + 1, min_y:max_y + 1]
+        terrain = numpy.asarray(self.terrain[min_x:max_x + 1, min_y:max_y + 1])
+        markers = numpy.asarray(self.markers[min_x:max_x + 1, min_y:max_y + 1])
+        window = numpy.left_shift(terrain.astype(numpy.uint64), numpy.uint64(TERRAIN_SHIFT))
+        for layer_value in numpy.unique(markers).tolist():
+            if layer_value != 0:
+                window[markers == layer_value] |= numpy.uint64(MARKER_VALUES[layer_value])
+        for (x, y), entity_id in self.spatial_hash.in_rectangle(min_x, min_y, max_x, max_y):
+            drawable = entity_drawable(self.entities.name_of(entity_id))
+            if drawable is not None:
+                window[x - min_x, y - min_y] |= numpy.uint64(drawable.value)
+        return window
+
+    def mark_changed(self, x, y):
+        self.version = self.version + 1
+        self.cell_versions[x, y] = self.version
+
+    def mark_all_changed(self):
+        """Record a bulk write that touched every cell"""
+        self.version = self.version + 1
+        self.cell_versions.fill(self.version)
 
-    def import_array(self, array):
-        """import an array to represent a portion of the map visible to a warbot or opfor"""
-        self.array = numpy.array(array)
-        self.width = self.array.shape[0]
-        self.height = self.array.shape[1]
+    def changed_cells(self, since_version):
+        """List of (x, y) for every cell written after since_version"""
+        if self.chunked:
+            return self.cell_versions.cells_above(since_version)
+        xs, ys = numpy.nonzero(self.cell_versions > since_version)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def window_changed(self, min_x, min_y, max_x, max_y, since_version):
+        """True if any cell from (min_x, min_y) to (max_x, max_y) inclusive was written after since_version"""
+        return int(self.cell_versions[min_x:max_x + 1, min_y:max_y + 1].max()) > since_version
+
+    def set_terrain(self, terrain):
+        """Replace the terrain of every cell at once with terrain, an array of terrain layer values; a dense
+           grid adopts the array without a copy, so a copy-on-write memory map stays shared until written"""
+        if self.chunked:
+            # the most common terrain is the layer's default, so stretches of it take no chunks
+            default = int(numpy.argmax(numpy.bincount(numpy.asarray(terrain).ravel())))
+            self.terrain = ChunkedLayer.from_array(terrain, default)
+        else:
+            self.terrain = terrain
+        # rebuilt from the layers on next use rather than patched cell by cell
+        self.packed = None
+        self.mark_all_changed()
+
+    def set_lazy_terrain(self, generate):
+        """Replace the terrain of a chunked grid with terrain made a chunk at a time by generate, the
+           first time a cell in the chunk is read (see ChunkedLayer)"""
+        self.terrain = ChunkedLayer(self.width, self.height, numpy.uint8, generate=generate)
+        self.packed = None
+        self.mark_all_changed()
+
+    def evict_terrain(self, keep):
+        """Drop generated terrain chunks for which keep(chunk_x, chunk_y) is False; returns how many were dropped"""
+        if not isinstance(self.terrain, ChunkedLayer):
+            return 0
+        return self.terrain.evict(keep)
+
+    def set_markers(self, markers):
+        """Replace the markers of every cell at once with markers, an array of marker layer values"""
+        self.markers = ChunkedLayer.from_array(markers) if self.chunked else markers
+        self.packed = None
+        self.mark_all_changed()
+
+    def cell_key(self, point):
+        # negative coordinates index from the far edge, as numpy indexing does
+        x = point.x + self.width if point.x < 0 else point.x
+        y = point.y + self.height if point.y < 0 else point.y
+        return x, y
+
+    def entity_bits(self, x, y):
+        """OR of the Drawable values of the agents in cell (x, y) that have one"""
+        bits = 0
+        for entity_id in self.spatial_hash.at(x, y):
+            drawable = entity_drawable(self.entities.name_of(entity_id))
+            if drawable is not None:
+                bits = bits | drawable.value
+        return bits
+
+    def cell_value(self, point):
+        """Packed value of the cell at point"""
+        x, y = self.cell_key(point)
+        value = (int(self.terrain[x, y]) << TERRAIN_SHIFT) | MARKER_VALUES[int(self.markers[x, y])]
+        if (x, y) in self.spatial_hash.cells:
+            value = value | self.entity_bits(x, y)
+        return value
+
+    def set_cell_value(self, point, value):
+        x, y = self.cell_key(point)
+        self.terrain[x, y] = (value & TERRAIN_BITS) >> TERRAIN_SHIFT
+        self.markers[x, y] = marker_layer_value(value)
+        new_names = [BIT_DRAWABLES[bit.bit_length() - 1].name for bit in set_bits(value & ENTITY_BITS)]
+        # agents with a Drawable are replaced by those in value; agents without one stay
+        for entity_id in list(self.spatial_hash.at(x, y)):
+            name = self.entities.name_of(entity_id)
+            if entity_drawable(name) is not None and name not in new_names:
+                self.remove_entity(name)
+        for name in new_names:
+            self.move_entity(name, Point(x, y))
+        if self.packed is not None:
+            self.packed[x, y] = value & (TERRAIN_BITS | MARKER_BITS) | self.entity_bits(x, y)
+        self.mark_changed(x, y)
 
     def __getitem__(self, point):  # point must be a Point; returned value is a list of Drawable
         drawables_present = []
-        raw_value = int(self.array[point.x][point.y])
-        # print("{} raw value is {}".format(point, raw_value))
-        for draw in self.all_drawables:
-            if (Drawable[draw].value & raw_value) > 0:
-                drawables_present.append(Drawable[draw])
+        raw_value = self.cell_value(point)
+        # walk the set bits from lowest to highest, which is also Drawable declaration order
+        while raw_value != 0:
+            lowest_bit = raw_value & -raw_value
+            drawable = BIT_DRAWABLES[lowest_bit.bit_length() - 1]
+            if drawable is not None:
+                drawables_present.append(drawable)
+            raw_value = raw_value ^ lowest_bit
         return drawables_present
 
     def __setitem__(self, point, drawables_list):  # point must be a Point, drawables_list must be a list of Drawable
@@ -54,4 +385,120 @@ class Grid:
             raw_value = raw_value | draw.value
             # print("raw_value is {}".format(raw_value))
         # print("Setting {} to {}".format(point, raw_value))
-        self.array[point.x][point.y] = raw_value
+        self.set_cell_value(point, raw_value)
+
+    def add(self, point, drawable):
+        """Put drawable in the cell at point, keeping whatever else is there"""
+        self.set_cell_value(point, self.cell_value(point) | drawable.value)
+
+    def remove(self, point, drawable):
+        """Take drawable out of the cell at point, keeping whatever else is there"""
+        self.set_cell_value(point, self.cell_value(point) & ~drawable.value)
+
+    def location_of(self, name):
+        """(x, y) of the cell holding the agent name, or None if it is not on the grid"""
+        return self.entities.location_of(name)
+
+    def entities_at(self, point):
+        """Names of the agents in the cell at point"""
+        x, y = self.cell_key(point)
+        return [self.entities.name_of(entity_id) for entity_id in self.spatial_hash.at(x, y)]
+
+    def entities_in_rectangle(self, min_x, min_y, max_x, max_y):
+        """(name, (x, y)) of every agent in the cells from (min_x, min_y) to (max_x, max_y) inclusive"""
+        return [(self.entities.name_of(entity_id), cell)
+                for cell, entity_id in self.spatial_hash.in_rectangle(min_x, min_y, max_x, max_y)]
+
+    def entities_within(self, point, radius):
+        """(name, (x, y)) of every agent no more than radius (straight line distance) from point"""
+        return [(self.entities.name_of(entity_id), cell)
+                for cell, entity_id in self.spatial_hash.within(point.x, point.y, radius)]
+
+    def remove_entity(self, name):
+        """Take the agent name off the grid"""
+        entity_id = self.entities.id_of(name)
+        if entity_id is None or self.entities.locations[entity_id] is None:
+            return
+        x, y = self.entities.locations[entity_id]
+        self.entities.locations[entity_id] = None
+        self.spatial_hash.remove(entity_id, x, y)
+        self.entity_counts[x, y] -= 1
+        drawable = entity_drawable(name)
+        if self.packed is not None and drawable is not None:
+            self.packed[x, y] &= numpy.uint64(~drawable.value & (2 ** 64 - 1))
+        self.mark_changed(x, y)
+
+    def move_entity(self, name, point):
+        """Put the agent name in the cell at point, taking it out of its previous cell if it has one"""
+        self.remove_entity(name)
+        entity_id = self.entities.register(name)
+        x, y = self.cell_key(point)
+        self.entities.locations[entity_id] = (x, y)
+        self.spatial_hash.insert(entity_id, x, y)
+        self.entity_counts[x, y] += 1
+        drawable = entity_drawable(name)
+        if self.packed is not None and drawable is not None:
+            self.packed[x, y] |= numpy.uint64(drawable.value)
+        self.mark_changed(x, y)
+
+    def has(self, point, mask):
+        """True if the cell at point has every bit of mask (OR-ed Drawable values) set"""
+        return self.cell_value(point) & mask == mask
+
+    def any_of(self, point, mask):
+        """True if the cell at point has at least one bit of mask (OR-ed Drawable values) set"""
+        return self.cell_value(point) & mask != 0
+
+    def is_empty(self, point):
+        x, y = self.cell_key(point)
+        return self.terrain[x, y] == 0 and self.markers[x, y] == 0 and self.entity_counts[x, y] == 0
+
+    def is_occupied(self, point):
+        """True if the cell at point is water or holds an agent"""
+        x, y = self.cell_key(point)
+        return self.entity_counts[x, y] != 0 or self.terrain[x, y] & WATER_TERRAIN_BIT != 0
+
+    def cells_matching(self, mask):
+        """Boolean array over the grid that is True where a cell has any bit of mask set"""
+        matching = numpy.zeros((self.width, self.height), bool)
+        terrain_mask = (mask & TERRAIN_BITS) >> TERRAIN_SHIFT
+        if terrain_mask != 0:
+            matching |= bits_set(self.terrain, terrain_mask)
+        marker_mask = marker_layer_value(mask)
+        if marker_mask != 0:
+            matching |= bits_set(self.markers, marker_mask)
+        entity_mask = mask & ENTITY_BITS
+        if entity_mask != 0:
+            for (x, y) in self.spatial_hash.cells:
+                if self.entity_bits(x, y) & entity_mask != 0:
+                    matching[x, y] = True
+        return matching
+
+    def mask_of(self, drawables):
+        """Boolean array over the grid that is True where a cell holds any of drawables"""
+        mask = 0
+        for drawable in drawables:
+            mask = mask | drawable.value
+        return self.cells_matching(mask)
+
+    def cells_with(self, drawable):
+        """List of (x, y) for every cell holding drawable"""
+        xs, ys = numpy.nonzero(self.mask_of([drawable]))
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def drawables_with(self, mask):
+        """(x, y, Drawable) for every bit of mask set anywhere in the grid, ordered by x, then y, then bit"""
+        xs, ys = numpy.nonzero(self.cells_matching(mask))
+        found = []
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            for bit in set_bits(self.cell_value(Point(x, y)) & mask):
+                found.append((x, y, BIT_DRAWABLES[bit.bit_length() - 1]))
+        return found
+
+    def occupied_mask(self):
+        """Boolean array over the grid that is True where agents cannot enter (water or another agent)"""
+        return numpy.logical_or(bits_set(self.entity_counts, 0xFFFF), numpy.logical_not(self.navigable_mask()))
+
+    def navigable_mask(self):
+        """Boolean array over the grid that is True where route planning may enter (no water)"""
+        return numpy.logical_not(bits_set(self.terrain, WATER_TERRAIN_BIT))
@@ -0,0 +1,255 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# hierarchical path finding (HPA*)
+#
+# The map is cut into square clusters.  Wherever two neighboring clusters share an
+# open stretch of border, that entrance gets a pair of abstract nodes, one on each
+# side.  Abstract nodes in the same cluster are joined by edges weighted with their
+# distance inside the cluster.  A long path is then a small search over the
+# abstract graph, refined into cells one cluster at a time.  A terrain change only
+# rebuilds the entrances and edges of the clusters around it.
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+from math import inf
+
+from shared.constants import HPA_CLUSTER_SIZE
+from simulation.direction import Direction
+from simulation.point import Point
+
+NEIGHBOR_VECTORS = [direction.value for direction in Direction]
+
+# entrances at least this wide get a transition at each end instead of one in the middle
+WIDE_ENTRANCE = 6
+
+
+def chebyshev_distance(from_cell, to_cell):
+    return max(abs(from_cell[0] - to_cell[0]), abs(from_cell[1] - to_cell[1]))
+
+
+class HierarchicalMap:
+    """Abstract cluster graph over a 2D boolean navigable array indexed as [x][y]"""
+    def __init__(self, navigable, cluster_size=HPA_CLUSTER_SIZE):
+        self.width = navigable.shape[0]
+        self.height = navigable.shape[1]
+        self.navigable = navigable.tolist()
+        self.cluster_size = cluster_size
+        self.cluster_columns = (self.width + cluster_size - 1) // cluster_size
+        self.cluster_rows = (self.height + cluster_size - 1) // cluster_size
+        # (cluster, neighboring cluster to the east or south) -> list of (cell, cell) transitions
+        self.entrances = {}
+        # cluster -> {abstract node: {abstract node in the same cluster: distance}}
+        self.intra_edges = {}
+        # abstract node -> set of abstract nodes across a cluster border
+        self.inter_edges = {}
+        for cluster in self.clusters():
+            for border in self.borders(cluster):
+                if border[0] == cluster:
+                    self.build_entrances(border)
+        self.build_inter_edges()
+        for cluster in self.clusters():
+            self.build_intra_edges(cluster)
+
+    def clusters(self):
+        return [(column, row) for column in range(self.cluster_columns) for row in range(self.cluster_rows)]
+
+    def cluster_of(self, cell):
+        return cell[0] // self.cluster_size, cell[1] // self.cluster_size
+
+    def cluster_bounds(self, cluster):
+        min_x = cluster[0] * self.cluster_size
+        min_y = cluster[1] * self.cluster_size
+        max_x = min(min_x + self.cluster_size, self.width) - 1
+        max_y = min(min_y + self.cluster_size, self.height) - 1
+        return min_x, min_y, max_x, max_y
+
+    def borders(self, cluster):
+        """Keys of the (up to four) borders of cluster, each ordered west-to-east or north-to-south"""
+        column, row = cluster
+        borders = []
+        if column > 0:
+            borders.append(((column - 1, row), cluster))
+        if column < self.cluster_columns - 1:
+            borders.append((cluster, (column + 1, row)))
+        if row > 0:
+            borders.append(((column, row - 1), cluster))
+        if row < self.cluster_rows - 1:
+            borders.append((cluster, (column, row + 1)))
+        return borders
+
+    def is_navigable(self, cell):
+        return 0 <= cell[0] < self.width and 0 <= cell[1] < self.height and self.navigable[cell[0]][cell[1]]
+
+    def build_entrances(self, border):
+        """Find the open stretches along one border and place transitions on them"""
+        first, second = border
+        min_x, min_y, max_x, max_y = self.cluster_bounds(first)
+        if second[0] > first[0]:  # vertical border between first (west) and second (east)
+            pairs = [((max_x, y), (max_x + 1, y)) for y in range(min_y, max_y + 1)]
+        else:  # horizontal border between first (north) and second (south)
+            pairs = [((x, max_y), (x, max_y + 1)) for x in range(min_x, max_x + 1)]
+        transitions = []
+        run = []
+        for pair in pairs + [None]:
+            if pair is not None and self.is_navigable(pair[0]) and self.is_navigable(pair[1]):
+                run.append(pair)
+                continue
+            if len(run) >= WIDE_ENTRANCE:
+                transitions.extend([run[0], run[-1]])
+            elif len(run) > 0:
+                transitions.append(run[len(run) // 2])
+            run = []
+        self.entrances[border] = transitions
+
+    def build_inter_edges(self):
+        self.inter_edges = {}
+        for transitions in self.entrances.values():
+            for first, second in transitions:
+                self.inter_edges.setdefault(first, set()).add(second)
+                self.inter_edges.setdefault(second, set()).add(first)
+
+    def cluster_nodes(self, cluster):
+        nodes = set()
+        for border in self.borders(cluster):
+            for first, second in self.entrances.get(border, []):
+                nodes.add(first if self.cluster_of(first) == cluster else second)
+        return nodes
+
+    def local_distances(self, cluster, start, targets=None):
+        """Breadth first search inside cluster from start; distances and parents of every cell reached"""
+        min_x, min_y, max_x, max_y = self.cluster_bounds(cluster)
+        distances = {start: 0}
+        parents = {start: None}
+        remaining = set(targets) if targets is not None else None
+        frontier = deque([start])
+        while len(frontier) > 0:
+            cell = frontier.popleft()
+            if remaining is not None:
+                remaining.discard(cell)
+                if len(remaining) == 0:
+                    break
+            for vector_x, vector_y in NEIGHBOR_VECTORS:
+                next_cell = (cell[0] + vector_x, cell[1] + vector_y)
+                if next_cell not in distances and min_x <= next_cell[0] <= max_x and \
+                        min_y <= next_cell[1] <= max_y and self.navigable[next_cell[0]][next_cell[1]]:
+                    distances[next_cell] = distances[cell] + 1
+                    parents[next_cell] = cell
+                    frontier.append(next_cell)
+        return distances, parents
+
+    def local_path(self, cluster, start, goal):
+        distances, parents = self.local_distances(cluster, start, [goal])
+        if goal not in distances:
+            return None
+        cells = []
+        cell = goal
+        while cell is not None:
+            cells.append(cell)
+            cell = parents[cell]
+        return cells[::-1]
+
+    def build_intra_edges(self, cluster):
+        nodes = self.cluster_nodes(cluster)
+        edges = {}
+        for node in nodes:
+            distances, _ = self.local_distances(cluster, node, nodes)
+            edges[node] = dict((other, distances[other]) for other in nodes if other != node and other in distances)
+        self.intra_edges[cluster] = edges
+
+    def update(self, x, y, navigable):
+        """Rebuild the entrances and edges around one cell after its navigability changes"""
+        if not (0 <= x < self.width and 0 <= y < self.height) or self.navigable[x][y] == navigable:
+            return
+        self.navigable[x][y] = navigable
+        cluster = self.cluster_of((x, y))
+        touched = {cluster}
+        for border in self.borders(cluster):
+            self.build_entrances(border)
+            touched.update(border)
+        self.build_inter_edges()
+        for touched_cluster in touched:
+            self.build_intra_edges(touched_cluster)
+
+    def abstract_neighbors(self, node, extra_edges):
+        neighbors = dict(self.intra_edges[self.cluster_of(node)].get(node, {}))
+        for other in self.inter_edges.get(node, ()):
+            neighbors[other] = 1
+        neighbors.update(extra_edges.get(node, {}))
+        return neighbors
+
+    def connect(self, cell, extra_edges):
+        """Temporarily join a start or goal cell to the abstract nodes of its cluster"""
+        cluster = self.cluster_of(cell)
+        nodes = self.cluster_nodes(cluster)
+        distances, _ = self.local_distances(cluster, cell, nodes)
+        for node in nodes:
+            if node != cell and node in distances:
+                extra_edges.setdefault(cell, {})[node] = distances[node]
+                extra_edges.setdefault(node, {})[cell] = distances[node]
+
+    def abstract_search(self, start, goal, extra_edges):
+        sequence = count()
+        open_list = [(chebyshev_distance(start, goal), 0, next(sequence), start)]
+        costs = {start: 0}
+        parents = {start: None}
+        closed_set = set()
+        while len(open_list) > 0:
+            _, cost, _, node = heappop(open_list)
+            if node in closed_set:
+                continue
+            closed_set.add(node)
+            if node == goal:
+                nodes = []
+                while node is not None:
+                    nodes.append(node)
+                    node = parents[node]
+                return nodes[::-1]
+            for neighbor, edge_cost in self.abstract_neighbors(node, extra_edges).items():
+                new_cost = cost + edge_cost
+                if neighbor not in closed_set and new_cost < costs.get(neighbor, inf):
+                    costs[neighbor] = new_cost
+                    parents[neighbor] = node
+                    heappush(open_list, (new_cost + chebyshev_distance(neighbor, goal),
+                                         new_cost, next(sequence), neighbor))
+        return None
+
+    def refine(self, nodes):
+        cells = [nodes[0]]
+        for node, next_node in zip(nodes, nodes[1:]):
+            if self.cluster_of(node) != self.cluster_of(next_node):  # step across a border
+                cells.append(next_node)
+            else:
+                cells.extend(self.local_path(self.cluster_of(node), node, next_node)[1:])
+        return cells
+
+    def find_path(self, from_location, to_location):
+        """Path in the same form as a_star.find_path, or None if the abstract graph has no route"""
+        start = (from_location.x, from_location.y)
+        goal = (to_location.x, to_location.y)
+        if not (0 <= start[0] < self.width and 0 <= start[1] < self.height) or not self.is_navigable(goal):
+            return None
+        if self.cluster_of(start) == self.cluster_of(goal):
+            cells = self.local_path(self.cluster_of(start), start, goal)
+            if cells is not None:
+                return [Point(x, y) for x, y in cells]
+        extra_edges = {}
+        self.connect(start, extra_edges)
+        self.connect(goal, extra_edges)
+        nodes = self.abstract_search(start, goal, extra_edges)
+        if nodes is None:
+            return None
+        return [Point(x, y) for x, y in self.refine(nodes)]
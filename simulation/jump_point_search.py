@@ -0,0 +1,169 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Jump Point Search path finding
+#
+# JPS is A* on an 8-connected, uniform-cost grid where passability is binary.
+# Instead of pushing every neighbor onto the open list, it "jumps" along straight
+# and diagonal lines and only stops at jump points: the goal, or cells that have
+# a forced neighbor next to an obstacle.  Large open areas therefore cost a few
+# heap operations instead of one per cell.  Diagonal moves may cut corners, which
+# matches the neighbors that A* considers in get_enterable_adjacent_locations.
+from heapq import heappop, heappush
+from itertools import count
+from math import sqrt
+
+from simulation.direction import Direction
+from simulation.point import Point
+
+SQRT_2 = sqrt(2)
+
+
+def octile_distance(from_x, from_y, to_x, to_y):
+    dx = abs(from_x - to_x)
+    dy = abs(from_y - to_y)
+    return max(dx, dy) + (SQRT_2 - 1) * min(dx, dy)
+
+
+def sign(value):
+    return (value > 0) - (value < 0)
+
+
+class JumpPointSearch:
+    """Single Jump Point Search query against a map with navigable_cells"""
+    def __init__(self, my_map, to_location):
+        self.goal = (to_location.x, to_location.y)
+        # the whole navigable mask is read once; plain lists are much faster than numpy element access
+        self.navigable = my_map.navigable_cells().tolist()
+        self.origin = my_map.offset_point(Point(0, 0))
+        self.width = len(self.navigable)
+        self.height = len(self.navigable[0]) if self.width > 0 else 0
+        self.expanded_count = 0
+
+    def walkable(self, x, y):
+        x = x - self.origin.x
+        y = y - self.origin.y
+        return 0 <= x < self.width and 0 <= y < self.height and self.navigable[x][y]
+
+    def pruned_directions(self, x, y, parent):
+        """Directions worth searching from (x, y) given the parent jump point"""
+        if parent is None:  # the start node searches every direction
+            return [direction.value for direction in Direction]
+        dx = sign(x - parent[0])
+        dy = sign(y - parent[1])
+        walkable = self.walkable
+        directions = []
+        if dx != 0 and dy != 0:  # diagonal: natural neighbors, then forced neighbors
+            directions.extend([(dx, 0), (0, dy), (dx, dy)])
+            if not walkable(x - dx, y):
+                directions.append((-dx, dy))
+            if not walkable(x, y - dy):
+                directions.append((dx, -dy))
+        elif dx != 0:  # horizontal
+            directions.append((dx, 0))
+            if not walkable(x, y + 1):
+                directions.append((dx, 1))
+            if not walkable(x, y - 1):
+                directions.append((dx, -1))
+        else:  # vertical
+            directions.append((0, dy))
+            if not walkable(x + 1, y):
+                directions.append((1, dy))
+            if not walkable(x - 1, y):
+                directions.append((-1, dy))
+        return directions
+
+    def jump(self, x, y, dx, dy):
+        """Step from (x, y) in direction (dx, dy) until a jump point is found; None if the line is blocked"""
+        walkable = self.walkable
+        while True:
+            x += dx
+            y += dy
+            if not walkable(x, y):
+                return None
+            if (x, y) == self.goal:
+                return x, y
+            if dx != 0 and dy != 0:
+                if (walkable(x - dx, y + dy) and not walkable(x - dx, y)) or \
+                        (walkable(x + dx, y - dy) and not walkable(x, y - dy)):
+                    return x, y
+                # a diagonal move is a jump point if either straight component reaches one
+                if self.jump(x, y, dx, 0) is not None or self.jump(x, y, 0, dy) is not None:
+                    return x, y
+            elif dx != 0:
+                if (walkable(x + dx, y + 1) and not walkable(x, y + 1)) or \
+                        (walkable(x + dx, y - 1) and not walkable(x, y - 1)):
+                    return x, y
+            else:
+                if (walkable(x + 1, y + dy) and not walkable(x + 1, y)) or \
+                        (walkable(x - 1, y + dy) and not walkable(x - 1, y)):
+                    return x, y
+
+    def search(self, from_location):
+        """Return the list of jump points from start to goal, or None if the goal cannot be reached"""
+        start = (from_location.x, from_location.y)
+        goal_x, goal_y = self.goal
+        sequence = count()
+        open_list = [(octile_distance(start[0], start[1], goal_x, goal_y), 0, next(sequence), start)]
+        movement_costs = {start: 0}
+        parents = {start: None}
+        closed_set = set()
+        while len(open_list) > 0:
+            current = heappop(open_list)[3]
+            if current in closed_set:
+                continue  # stale entry (lazy deletion)
+            closed_set.add(current)
+            self.expanded_count += 1
+            if current == self.goal:
+                jump_points = []
+                while current is not None:
+                    jump_points.append(current)
+                    current = parents[current]
+                return jump_points[::-1]
+            x, y = current
+            for dx, dy in self.pruned_directions(x, y, parents[current]):
+                jump_point = self.jump(x, y, dx, dy)
+                if jump_point is None or jump_point in closed_set:
+                    continue
+                movement_cost = movement_costs[current] + octile_distance(x, y, jump_point[0], jump_point[1])
+                if movement_cost < movement_costs.get(jump_point, movement_cost + 1):
+                    movement_costs[jump_point] = movement_cost
+                    parents[jump_point] = current
+                    cost = movement_cost + octile_distance(jump_point[0], jump_point[1], goal_x, goal_y)
+                    heappush(open_list, (cost, -movement_cost, next(sequence), jump_point))
+        return None
+
+
+def expand_jump_points(jump_points):
+    """Fill in every cell between consecutive jump points so agents can step along the path"""
+    x, y = jump_points[0]
+    path = [Point(x, y)]
+    for next_x, next_y in jump_points[1:]:
+        dx = sign(next_x - x)
+        dy = sign(next_y - y)
+        while (x, y) != (next_x, next_y):
+            x += dx
+            y += dy
+            path.append(Point(x, y))
+    return path
+
+
+# use Jump Point Search to find a path; same contract as a_star.find_path
+def find_path(my_map, from_location, to_location):
+    jump_points = JumpPointSearch(my_map, to_location).search(from_location)
+    if jump_points is None:
+        return None
+    return expand_jump_points(jump_points)
@@ -14,9 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+from functools import partial
 from random import randint
 
-from noise import pnoise3
+import numpy
 
 # map contains methods to create the elements that make up the simulated
 # map where the autonomous infantry squad operates
@@ -25,19 +26,48 @@ from simulation.abstract_map import AbstractMap
 from simulation.bullet import Bullet
 from simulation.direction import Direction
 from simulation.drawable import Drawable
+from simulation.flow_field import FlowField
+from simulation.grid import terrain_layer_value
+from simulation.hierarchical_path_finding import HierarchicalMap
 from simulation.point import Point
+from simulation.scenario import load_scenario
+from simulation.terrain_cache import TerrainCache
+from simulation.terrain_noise import pnoise3_grid
 
 
 class MissionMap(AbstractMap):
     """Procedurally-generated map where the warbot mission will be conducted """
+    # noise thresholds between the terrain bands, from low (water) to high (rock)
+    terrain_thresholds = [-0.35, -0.20, 0.1, 0.45, 0.75]
+    terrain_bands = [Drawable.WATER, Drawable.MUD, Drawable.DIRT, Drawable.GRASS, Drawable.TREE, Drawable.ROCK]
+    terrain_band_values = numpy.array([terrain_layer_value(drawable) for drawable in terrain_bands], numpy.uint8)
+    # Perlin noise parameters of the terrain
+    terrain_scale = 100.0
+    terrain_octaves = 6
+    terrain_persistence = 0.5
+    terrain_lacunarity = 2.0
+
     def __init__(self, args):
         AbstractMap.__init__(self)
         # bullet container
         self.bullets = []
         # previous agent locations for faster drawing
         self.previous_warbot_locations = {}
-        # initialize the default grid
-        self.grid.default_grid()
+        # flow fields shared by every warbot, keyed by goal (x, y) for the current terrain_version
+        self.flow_fields = {}
+        self.flow_fields_terrain_version = None
+        # cluster graph for long-range path finding, updated in place when terrain changes
+        self.hierarchical_map = None
+        # generated terrain is reused from here when the cache directory is set
+        self.terrain_cache = TerrainCache(args.t) if args.t else None
+        # terrain chunks are generated the first time they are read instead of all up front
+        self.lazy_terrain = args.lazy_terrain
+        # initialize the default grid, the size of the window unless a world size is given
+        self.grid.default_grid(args.width, args.height)
+        if args.load_scenario:
+            # a saved map replaces procedural generation entirely
+            self.apply_scenario(load_scenario(args.load_scenario))
+            return
         # randomly generate terrain
         self.generate_terrain(randint(100, 1000))
         # generate objective and opfor
@@ -49,13 +79,43 @@ class MissionMap(AbstractMap):
         # generate civilians
         self.generate_civilian_locations(args.c)
 
+    def apply_scenario(self, scenario):
+        """Take the terrain, markers and agent placements of a loaded scenario"""
+        self.grid.width = scenario.terrain.shape[0]
+        self.grid.height = scenario.terrain.shape[1]
+        self.grid.create_layers()
+        self.grid.set_terrain(scenario.terrain)
+        self.grid.set_markers(scenario.markers)
+        self.objective_location = Point(scenario.objective_location[0], scenario.objective_location[1])
+        self.rally_point_location = Point(scenario.rally_point_location[0], scenario.rally_point_location[1])
+        self.warbot_locations = {}
+        self.opfor_locations = {}
+        self.civilian_locations = {}
+        for name, (x, y) in scenario.agents:
+            location = Point(x, y)
+            self.grid.move_entity(name, location)
+            if name.startswith(WARBOT_PREFIX):
+                self.warbot_locations[name] = location
+                self.previous_warbot_locations[name] = None
+            elif name.startswith(OPFOR_PREFIX):
+                self.opfor_locations[name] = location
+            elif name.startswith(CIVILIAN_PREFIX):
+                self.civilian_locations[name] = location
+        self.reachability = None
+        self.hierarchical_map = None
+        self.terrain_version = self.terrain_version + 1
+
     def generate_objective_location(self):
         self.objective_location = self.get_random_upper_location_on_dirt()
-        self.grid[self.objective_location] = [Drawable.OBJECTIVE]
+        if self.objective_location is None:
+            raise ValueError("The map has no navigable cell for the objective")
+        self.set_cell(self.objective_location, [Drawable.OBJECTIVE])
 
     def generate_rally_point_location(self):
         self.rally_point_location = self.get_random_lower_location_on_dirt()
-        self.grid[self.rally_point_location] = [Drawable.RALLY_POINT]
+        if self.rally_point_location is None:
+            raise ValueError("The map has no navigable cell for the rally point")
+        self.set_cell(self.rally_point_location, [Drawable.RALLY_POINT])
 
     def generate_warbot_locations(self, warbot_count):
         self.warbot_locations = {}
@@ -66,7 +126,8 @@ class MissionMap(AbstractMap):
                 self.rally_point_location,
                 WARBOT_GENERATE_RADIUS)
             warbot_name = WARBOT_PREFIX + str(warbot_index)
-            self.grid[random_point] = [Drawable[warbot_name], Drawable.DIRT]
+            self.set_cell(random_point, [Drawable.DIRT])
+            self.grid.move_entity(warbot_name, random_point)
             self.warbot_locations[warbot_name] = random_point
             self.previous_warbot_locations[warbot_name] = None
             warbot_index = warbot_index + 1
@@ -79,9 +140,9 @@ class MissionMap(AbstractMap):
             random_point = self.get_random_unoccupied_location_near_point(
                 self.objective_location,
                 OPFOR_GENERATE_RADIUS)
-            # print ("random_point: {} for drawable: {}".format(random_point, Drawable["OPFOR_" + str(opfor_index)]))
             opfor_name = OPFOR_PREFIX + str(opfor_index)
-            self.grid[random_point] = [Drawable[opfor_name], Drawable.DIRT]
+            self.set_cell(random_point, [Drawable.DIRT])
+            self.grid.move_entity(opfor_name, random_point)
             self.opfor_locations[opfor_name] = random_point
             opfor_index = opfor_index + 1
 
@@ -90,64 +151,162 @@ class MissionMap(AbstractMap):
         civilian_index = 1
         while civilian_index <= civilian_count:
             random_point = self.get_random_unoccupied_location()
+            if random_point is None:
+                logging.warning("No unoccupied cell left; placed {} of {} civilians"
+                                .format(civilian_index - 1, civilian_count))
+                return
             civilian_name = CIVILIAN_PREFIX + str(civilian_index)
-            self.grid[random_point] = [Drawable[civilian_name], Drawable.DIRT]
+            self.set_cell(random_point, [Drawable.DIRT])
+            self.grid.move_entity(civilian_name, random_point)
             self.civilian_locations[civilian_name] = random_point
             civilian_index = civilian_index + 1
 
+    def generate_terrain_window(self, seed, min_x, min_y, max_x, max_y):
+        """Terrain layer values of the cells from (min_x, min_y) to (max_x, max_y) inclusive"""
+        scale = MissionMap.terrain_scale
+        # equal to calling pnoise3 for each cell, so any window matches the same cells of the whole map
+        noise = pnoise3_grid(numpy.arange(min_x, max_x + 1) / scale,
+                             numpy.arange(min_y, max_y + 1) / scale,
+                             seed / scale,
+                             octaves=MissionMap.terrain_octaves,
+                             persistence=MissionMap.terrain_persistence,
+                             lacunarity=MissionMap.terrain_lacunarity,
+                             repeatx=self.grid.width,
+                             repeaty=self.grid.height,
+                             base=0)
+        # band i holds the noise values below terrain_thresholds[i] and not below the threshold before it
+        bands = numpy.digitize(noise, MissionMap.terrain_thresholds)
+        return MissionMap.terrain_band_values[bands]
+
     def generate_terrain(self, seed):
-        scale = 100.0
-        octaves = 6
-        persistence = 0.5
-        lacunarity = 2.0
-        for x in range(self.grid.width):
-            for y in range(self.grid.height):
-                current_point = Point(x, y)
-                noise = pnoise3(
-                    x/scale,
-                    y/scale,
-                    seed/scale,
-                    octaves=octaves,
-                    persistence=persistence,
-                    lacunarity=lacunarity,
-                    repeatx=self.grid.width,
-                    repeaty=self.grid.height,
-                    base=0)
-                if noise < -0.35:
-                    self.grid[current_point] = [Drawable.WATER]
-                elif noise < -0.20:
-                    self.grid[current_point] = [Drawable.MUD]
-                elif noise < 0.1:
-                    self.grid[current_point] = [Drawable.DIRT]
-                elif noise < 0.45:
-                    self.grid[current_point] = [Drawable.GRASS]
-                elif noise < 0.75:
-                    self.grid[current_point] = [Drawable.TREE]
-                else:
-                    self.grid[current_point] = [Drawable.ROCK]
+        if self.lazy_terrain:
+            # nothing is generated until an agent's window, a path query or the display reads it
+            self.grid.set_lazy_terrain(partial(self.generate_terrain_window, seed))
+        else:
+            parameters = (MissionMap.terrain_scale, MissionMap.terrain_octaves, MissionMap.terrain_persistence,
+                          MissionMap.terrain_lacunarity, MissionMap.terrain_thresholds)
+            terrain = None
+            if self.terrain_cache is not None:
+                terrain = self.terrain_cache.load(seed, self.grid.width, self.grid.height, parameters)
+            if terrain is None:
+                terrain = numpy.empty((self.grid.width, self.grid.height), numpy.uint8)
+                # a strip of columns at a time keeps the float noise arrays small however big the world is
+                for min_x in range(0, self.grid.width, GRID_CHUNK_SIZE):
+                    max_x = min(min_x + GRID_CHUNK_SIZE, self.grid.width) - 1
+                    terrain[min_x:max_x + 1, :] = self.generate_terrain_window(seed, min_x, 0, max_x,
+                                                                               self.grid.height - 1)
+                if self.terrain_cache is not None:
+                    self.terrain_cache.store(seed, self.grid.width, self.grid.height, parameters, terrain)
+            self.grid.set_terrain(terrain)
+        # the terrain was rewritten, so any reachability index, flow field or cluster graph is stale
+        self.reachability = None
+        self.hierarchical_map = None
+        self.terrain_version = self.terrain_version + 1
+
+    def evict_terrain_chunks(self, distance):
+        """Drop lazily generated terrain chunks more than distance chunks from every warbot and OPFOR;
+           they are generated again if read.  Returns how many were dropped"""
+        agent_chunks = set()
+        for agent_locations in [self.warbot_locations, self.opfor_locations]:
+            if agent_locations is not None:
+                for location in agent_locations.values():
+                    agent_chunks.add((location.x // GRID_CHUNK_SIZE, location.y // GRID_CHUNK_SIZE))
+        return self.grid.evict_terrain(lambda chunk_x, chunk_y: any(
+            max(abs(chunk_x - agent_x), abs(chunk_y - agent_y)) <= distance for agent_x, agent_y in agent_chunks))
+
+    def get_flow_field(self, goal):
+        """Flow field toward goal, computed once per goal per terrain version"""
+        if self.flow_fields_terrain_version != self.terrain_version:
+            self.flow_fields = {}
+            self.flow_fields_terrain_version = self.terrain_version
+        key = (goal.x, goal.y)
+        if key not in self.flow_fields:
+            self.flow_fields[key] = FlowField(self.navigable_cells(), goal, self.movement_costs())
+        return self.flow_fields[key]
+
+    def plans_on_whole_map(self):
+        """True if flow fields and the cluster graph are built.  Both cover the whole map, so they are
+           skipped above WHOLE_MAP_PLANNING_MAX_CELLS, and with lazy terrain, which they would generate in full"""
+        return not self.lazy_terrain and self.grid.width * self.grid.height <= WHOLE_MAP_PLANNING_MAX_CELLS
+
+    def get_hierarchical_map(self):
+        """Cluster graph for hierarchical path finding over the whole mission map, built on first use;
+           None when plans_on_whole_map is False"""
+        if not self.plans_on_whole_map():
+            return None
+        if self.hierarchical_map is None:
+            self.hierarchical_map = HierarchicalMap(self.navigable_cells())
+        return self.hierarchical_map
+
+    def set_cell(self, point, drawables):
+        """Rewrite the cell at point with drawables and update the route planning data that depends on it"""
+        self.grid[point] = drawables
+        self.terrain_changed(point)
+
+    def terrain_changed(self, point):
+        """Also rebuild the cluster graph around point, if one has been built"""
+        AbstractMap.terrain_changed(self, point)
+        if self.hierarchical_map is not None:
+            self.hierarchical_map.update(point.x, point.y, self.is_navigable(point))
+
+    def get_formation_anchor_locations(self):
+        """Squad column wedge positions that warbots form up on around the rally point"""
+        squad_leader_location = self.rally_point_location.plus_vector(SCW_SQUAD_LEADER_OFFSET)
+        team_b_leader_location = squad_leader_location.plus_vector(SCW_TEAM_B_LEADER_OFFSET)
+        anchors = [squad_leader_location, team_b_leader_location]
+        for offset in [SCW_A1_OFFSET, SCW_A2_OFFSET, SCW_A3_OFFSET, SCW_A4_OFFSET]:
+            anchors.append(squad_leader_location.plus_vector(offset))
+        for offset in [SCW_B1_OFFSET, SCW_B2_OFFSET, SCW_B3_OFFSET, SCW_B4_OFFSET]:
+            anchors.append(team_b_leader_location.plus_vector(offset))
+        return anchors
+
+    def generate_flow_fields(self):
+        """Compute the flow fields toward the objective, the rally point and each formation anchor;
+           none when plans_on_whole_map is False"""
+        if not self.plans_on_whole_map():
+            return self.flow_fields
+        for goal in [self.objective_location, self.rally_point_location] + self.get_formation_anchor_locations():
+            self.get_flow_field(goal)
+        return self.flow_fields
 
     def get_random_location(self):
         return Point(randint(0, self.grid.width - 1), randint(0, self.grid.height - 1))
 
-    def get_random_upper_location_on_dirt(self):
+    def get_random_location_on_dirt(self, min_x, max_x, min_y, max_y):
+        """Random dirt location in the given bounds (inclusive), or any navigable one if there is no dirt;
+           bounds that are all water are widened until they are not, and None means the whole map is water"""
+        if self.lazy_terrain:
+            # look in one random chunk-sized part of the bounds so only the chunks under it are generated
+            min_x = randint(min_x, max(max_x - GRID_CHUNK_SIZE + 1, min_x))
+            min_y = randint(min_y, max(max_y - GRID_CHUNK_SIZE + 1, min_y))
+            max_x = min(max_x, min_x + GRID_CHUNK_SIZE - 1)
+            max_y = min(max_y, min_y + GRID_CHUNK_SIZE - 1)
         while True:
-            random_point = self.get_random_upper_location()
-            if Drawable.DIRT in self.grid[random_point]:
-                return random_point
+            window = self.grid.window(min_x, min_y, max_x, max_y)
+            candidates = numpy.bitwise_and(window, numpy.uint64(Drawable.DIRT.value)) != 0
+            if not candidates.any():
+                candidates = numpy.bitwise_and(window, numpy.uint64(Drawable.WATER.value)) == 0
+            xs, ys = numpy.nonzero(candidates)
+            if len(xs) > 0:
+                index = randint(0, len(xs) - 1)
+                return Point(min_x + int(xs[index]), min_y + int(ys[index]))
+            if (min_x, min_y, max_x, max_y) == (0, 0, self.grid.width - 1, self.grid.height - 1):
+                return None
+            # double the bounds around their center
+            width = max_x - min_x + 1
+            height = max_y - min_y + 1
+            min_x = max(min_x - width // 2 - 1, 0)
+            min_y = max(min_y - height // 2 - 1, 0)
+            max_x = min(max_x + width // 2 + 1, self.grid.width - 1)
+            max_y = min(max_y + height // 2 + 1, self.grid.height - 1)
 
-    def get_random_upper_location(self):
-        return Point(randint(int(0.25 * self.grid.width),   int(0.75 * self.grid.width)),   # X
-                     randint(int(0.20 * self.grid.height),  int(0.30 * self.grid.height)))  # Y
+    def get_random_upper_location_on_dirt(self):
+        return self.get_random_location_on_dirt(int(0.25 * self.grid.width), int(0.75 * self.grid.width),
+                                                int(0.20 * self.grid.height), int(0.30 * self.grid.height))
 
     def get_random_lower_location_on_dirt(self):
-        while True:
-            random_point = self.get_random_lower_location()
-            if Drawable.DIRT in self.grid[random_point]:
-                return random_point
-
-    def get_random_lower_location(self):
-        return Point(randint(int(0.25 * self.grid.width),   int(0.75 * self.grid.width)),   # X
-                     randint(int(0.85 * self.grid.height),  int(0.95 * self.grid.height)))  # Y
+        return self.get_random_location_on_dirt(int(0.25 * self.grid.width), int(0.75 * self.grid.width),
+                                                int(0.85 * self.grid.height), int(0.95 * self.grid.height))
 
     def get_random_location_near_point(self, point, radius):
         while True:
@@ -159,77 +318,90 @@ class MissionMap(AbstractMap):
                 return random_point
 
     def get_random_unoccupied_location_near_point(self, point, radius):
+        attempts = 0
         while True:
             random_point = self.get_random_location_near_point(point, radius)
             if not self.is_occupied(random_point):
                 return random_point
+            # widen the search once the area around point is likely full
+            attempts = attempts + 1
+            if attempts > 8 * radius:
+                radius = radius + 1
+                attempts = 0
 
     def get_random_unoccupied_location(self):
-        while True:
-            random_point = self.get_random_location()
-            if not self.is_occupied(random_point):
-                return random_point
+        """Random cell that is neither water nor holds an agent, or None if there is none"""
+        if self.lazy_terrain:
+            # random cells until one is free, rather than a mask that would generate every chunk
+            for attempt in range(UNOCCUPIED_LOCATION_ATTEMPTS):
+                random_point = self.get_random_location()
+                if not self.is_occupied(random_point):
+                    return random_point
+        xs, ys = numpy.nonzero(numpy.logical_not(self.grid.occupied_mask()))
+        if len(xs) == 0:
+            return None
+        index = randint(0, len(xs) - 1)
+        return Point(int(xs[index]), int(ys[index]))
 
-    def get_visible_map_around_point(self, point, distance):
-        # logging.debug("Getting rectangle of size {} around point {}".format(distance, point))
+    def get_visible_window(self, point, distance):
+        """Corners (minus, plus) of the window of cells within distance of point, clipped to the map"""
         minus = self.normalize_point(point.plus_vector(Direction.NORTHWEST.to_scaled_vector(distance)))
         plus = self.normalize_point(point.plus_vector(Direction.SOUTHEAST.to_scaled_vector(distance)))
+        return minus, plus
+
+    def get_visible_entities(self, minus, plus):
+        """[name, x, y] of every agent in the window from minus to plus, relative to minus"""
+        # agents are listed by name as well, since agents past the Drawable range have no bit in the grid
+        return [[name, x - minus.x, y - minus.y]
+                for name, (x, y) in self.grid.entities_in_rectangle(minus.x, minus.y, plus.x, plus.y)]
+
+    def get_visible_map_around_point(self, point, distance, grid_version=None):
+        """Visible map message contents for the window around point; with grid_version, the
+           window's cells are left out for the agent to read from the SharedGrid of that version"""
+        # logging.debug("Getting rectangle of size {} around point {}".format(distance, point))
+        minus, plus = self.get_visible_window(point, distance)
         # logging.debug("minus is {}, plus is {}".format(minus, plus))
+        entities = self.get_visible_entities(minus, plus)
+        if grid_version is not None:
+            return {YOUR_LOCATION: point.to_dict(),
+                    GRID_VERSION: grid_version,
+                    ENTITIES: entities,
+                    MIN_X: minus.x,
+                    MIN_Y: minus.y,
+                    MAX_X: plus.x,
+                    MAX_Y: plus.y}
         return {YOUR_LOCATION: point.to_dict(),
-                GRID: self.grid.array[minus.x:plus.x+1, minus.y:plus.y+1].tolist(),
+                GRID: self.grid.window(minus.x, minus.y, plus.x, plus.y).tolist(),
+                ENTITIES: entities,
                 MIN_X: minus.x,
                 MIN_Y: minus.y}
 
     def move_agent(self, agent_name, new_location):
         logging.debug("Attempting to move {} to new location: {}".format(agent_name, new_location))
         if agent_name.startswith(WARBOT_PREFIX):
-            agent_location = self.warbot_locations[agent_name]
-            # logging.debug("{} current location is {}".format(agent_name, agent_location))
             # if not self.is_occupied(new_location):
             self.previous_warbot_locations[agent_name] = self.warbot_locations[agent_name]
             self.warbot_locations[agent_name] = new_location
-            # get the current location and remove the warbot
-            # logging.debug("{} currently contains: {}".format(agent_location, self.grid[agent_location]))
-            drawables_at_agent_location = self.grid[agent_location]
-            drawables_at_agent_location.remove(Drawable[agent_name])
-            self.grid[agent_location] = drawables_at_agent_location
-            # logging.debug("{} now contains: {}".format(agent_location, self.grid[agent_location]))
-            # get the new location and add the warbot
-            # logging.debug("{} currently contains: {}".format(new_location, self.grid[new_location]))
-            drawables_at_new_location = self.grid[new_location]
-            drawables_at_new_location.insert(0, Drawable[agent_name])
-            self.grid[new_location] = drawables_at_new_location
-            # logging.debug("{} now contains: {}".format(new_location, self.grid[new_location]))
+            self.grid.move_entity(agent_name, new_location)
 
         elif agent_name.startswith(OPFOR_PREFIX):
-            agent_location = self.opfor_locations[agent_name]
             if not self.is_occupied(new_location):
                 self.opfor_locations[agent_name] = new_location
-                drawables_at_agent_location = self.grid[agent_location]
-                if len(drawables_at_agent_location) > 0:
-                    drawables_at_agent_location.remove(Drawable[agent_name])
-                self.grid[new_location] = self.grid[new_location].append(Drawable[agent_name])
+                self.grid.move_entity(agent_name, new_location)
 
     def create_bullet(self, location, direction):
         bullet = Bullet(location, direction)
         self.bullets.append(bullet)
-        drawables_at_next_location = self.grid[bullet.location]
-        drawables_at_next_location.insert(0, Drawable.BULLET)
-        self.grid[bullet.location] = drawables_at_next_location
+        self.grid.add(bullet.location, Drawable.BULLET)
 
     def move_bullet(self, bullet):
         # remove from current location
-        drawables_at_current_location = self.grid[bullet.location]
-        if Drawable.BULLET in drawables_at_current_location:
-            drawables_at_current_location.remove(Drawable.BULLET)
-        self.grid[bullet.location] = drawables_at_current_location
+        self.grid.remove(bullet.location, Drawable.BULLET)
         # advance bullet to next location
         bullet.next_location()
         if self.on_map(bullet.location):
             # add to next location
-            drawables_at_next_location = self.grid[bullet.location]
-            drawables_at_next_location.insert(0, Drawable.BULLET)
-            self.grid[bullet.location] = drawables_at_next_location
+            self.grid.add(bullet.location, Drawable.BULLET)
         else:
             self.bullets.remove(bullet)
 
@@ -238,20 +410,16 @@ class MissionMap(AbstractMap):
             self.move_bullet(bullet)
 
     def is_occupied(self, point):
-        for drawable in self.grid[point]:
-            if drawable in AbstractMap.occupied:
-                return True
-        return False
+        return self.grid.is_occupied(point)
 
     def is_navigable(self, point):
-        drawables = self.grid[point]
-        return Drawable.WATER not in drawables
+        return not self.grid.any_of(point, Drawable.WATER.value)
 
     def on_map(self, point):
         return 0 <= point.x < self.grid.width and 0 <= point.y < self.grid.height
 
     def empty(self, point):
-        return len(self.grid[point]) == 0
+        return self.grid.is_empty(point)
 
     def can_enter(self, point):
         return self.on_map(point) and not self.is_occupied(point)
@@ -279,8 +447,7 @@ class MissionMap(AbstractMap):
 
     def get_named_drawable_at_location(self, location, prefix):
         if self.on_map(location):
-            for drawable in self.grid[location]:
-                if drawable.name.startswith(prefix):
-                    return drawable.name
-        else:
-            return None
+            for name in self.grid.entities_at(location):
+                if name.startswith(prefix):
+                    return name
+        return None
@@ -0,0 +1,142 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# path planning service
+#
+# Agents may hand path finding to the simulation process instead of searching
+# their own cropped visible maps.  Answers come from an LRU cache keyed on
+# (start, goal, terrain version), and identical requests that arrive while one is
+# being planned share that search.  Searches run in a pool of worker processes so
+# the paths of several agents are planned on separate cores.
+import logging
+import signal
+import threading
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from shared.constants import PATH_CACHE_SIZE
+from simulation import a_star
+from simulation.point import Point
+
+# map the workers plan on, handed to each worker when it starts so that it is set under
+# every process start method, not only when the workers are forked
+worker_map = None
+
+
+def start_worker(mission_map, algorithm, heuristic_weight):
+    """Runs in each new worker process: keep the map that plan_in_worker searches, and take the
+       path finding settings of the simulation process, which a spawned worker does not inherit"""
+    global worker_map
+    # the simulation process handles Ctrl-C; a worker interrupted while holding the task queue
+    # lock would leave the pool unable to shut down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_map = mission_map
+    a_star.set_default_algorithm(algorithm)
+    a_star.set_heuristic_weight(heuristic_weight)
+
+
+def plan_in_worker(from_cell, to_cell):
+    """Runs in a worker process: the path between two (x, y) cells as a list of (x, y) cells, or None"""
+    path = a_star.find_path(worker_map, Point(from_cell[0], from_cell[1]), Point(to_cell[0], to_cell[1]))
+    if path is None:
+        return None
+    return [(location.x, location.y) for location in path]
+
+
+class PathService:
+    """Plans agent paths on the terrain of the mission map in a pool of worker processes"""
+    def __init__(self, mission_map, workers, cache_size=PATH_CACHE_SIZE):
+        self.mission_map = mission_map
+        self.workers = workers
+        self.cache_size = cache_size
+        # (from cell, to cell, terrain version) -> list of cells or None, least recently used first
+        self.cache = OrderedDict()
+        # key -> deliver callbacks waiting on the search in progress for key
+        self.pending = {}
+        # searches finish on the pool's result thread, so the cache and pending map are shared with it
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pool_terrain_version = None
+        # pools replaced after a terrain change, kept until shutdown so their searches are not cut off
+        self.closed_pools = []
+
+    def get_pool(self):
+        """Worker pool for the current terrain; replaced after the terrain changes"""
+        if self.pool is None or self.pool_terrain_version != self.mission_map.terrain_version:
+            if self.pool is not None:
+                self.pool.close()  # searches already submitted still finish
+                self.closed_pools.append(self.pool)
+            # build the lazily computed route planning data once here so every worker receives it
+            self.mission_map.reachability_index()
+            self.mission_map.movement_costs()
+            self.pool = Pool(self.workers, start_worker,
+                             (self.mission_map, a_star.default_algorithm, a_star.heuristic_weight))
+            self.pool_terrain_version = self.mission_map.terrain_version
+        return self.pool
+
+    def request_path(self, from_location, to_location, deliver):
+        """Call deliver with the path from from_location to to_location (as a_star.find_path returns it),
+           right away when the path is cached, otherwise from the pool's result thread once it is planned"""
+        from_cell = (from_location.x, from_location.y)
+        to_cell = (to_location.x, to_location.y)
+        key = (from_cell, to_cell, self.mission_map.terrain_version)
+        with self.lock:
+            cached = key in self.cache
+            if cached:
+                self.cache.move_to_end(key)
+                cells = self.cache[key]
+            elif key in self.pending:
+                self.pending[key].append(deliver)
+                return
+            else:
+                self.pending[key] = [deliver]
+        if cached:
+            deliver(cells_to_path(cells))
+            return
+        self.get_pool().apply_async(plan_in_worker, (from_cell, to_cell),
+                                    callback=lambda cells: self.finish(key, cells),
+                                    error_callback=lambda error: self.fail(key, error))
+
+    def fail(self, key, error):
+        logging.warning("Path planning service failed to plan {}: {}".format(key, error))
+        with self.lock:
+            waiting = self.pending.pop(key)
+        for deliver in waiting:
+            deliver(None)
+
+    def finish(self, key, cells):
+        with self.lock:
+            self.cache[key] = cells
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            waiting = self.pending.pop(key)
+        for deliver in waiting:
+            deliver(cells_to_path(cells))
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.closed_pools.append(self.pool)
+            self.pool = None
+        for pool in self.closed_pools:
+            pool.terminate()
+            pool.join()
+        self.closed_pools = []
+
+
+def cells_to_path(cells):
+    if cells is None:
+        return None
+    return [Point(x, y) for x, y in cells]
@@ -0,0 +1,131 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# reachability index: connected components of the navigable cells of a grid
+#
+# Two navigable cells are reachable from each other exactly when they carry the
+# same component label, so path finding can reject an unreachable goal (water,
+# an island, off the map) before searching instead of exhausting the map.
+from collections import deque
+
+import numpy
+
+from simulation.direction import Direction
+
+# label for cells that are not navigable
+UNREACHABLE = 0
+
+
+class ReachabilityIndex:
+    """Component labels for a 2D boolean navigable array indexed as [x][y]"""
+    def __init__(self, navigable):
+        self.width = navigable.shape[0]
+        self.height = navigable.shape[1]
+        self.navigable = numpy.array(navigable, dtype=bool)
+        self.labels = numpy.zeros((self.width, self.height), numpy.int32)
+        self.next_label = UNREACHABLE + 1
+        self.label_cells(self.navigable)
+
+    def new_label(self):
+        label = self.next_label
+        self.next_label = self.next_label + 1
+        return label
+
+    def on_grid(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def label_cells(self, cells):
+        """Give every navigable cell in the boolean cells array a label for its component"""
+        # plain lists are much faster than numpy element access in the flood fill loop
+        navigable = self.navigable.tolist()
+        labels = self.labels.tolist()
+        width = self.width
+        height = self.height
+        neighbor_vectors = [direction.value for direction in Direction]
+        for start_x, start_y in zip(*numpy.nonzero(cells)):
+            start_x = int(start_x)
+            start_y = int(start_y)
+            if labels[start_x][start_y] != UNREACHABLE:
+                continue
+            label = self.new_label()
+            labels[start_x][start_y] = label
+            frontier = deque([(start_x, start_y)])
+            while len(frontier) > 0:
+                x, y = frontier.popleft()
+                for vector_x, vector_y in neighbor_vectors:
+                    next_x = x + vector_x
+                    next_y = y + vector_y
+                    if 0 <= next_x < width and 0 <= next_y < height and navigable[next_x][next_y] \
+                            and labels[next_x][next_y] == UNREACHABLE:
+                        labels[next_x][next_y] = label
+                        frontier.append((next_x, next_y))
+        self.labels = numpy.array(labels, numpy.int32).reshape((width, height))
+
+    def label(self, x, y):
+        if self.on_grid(x, y):
+            return int(self.labels[x, y])
+        return UNREACHABLE
+
+    def start_labels(self, x, y):
+        """Components a walk starting at (x, y) can enter; a start cell that is itself
+           not navigable can still step into the components next to it"""
+        label = self.label(x, y)
+        if label != UNREACHABLE:
+            return {label}
+        labels = set()
+        for direction in Direction:
+            neighbor_label = self.label(x + direction.value[0], y + direction.value[1])
+            if neighbor_label != UNREACHABLE:
+                labels.add(neighbor_label)
+        return labels
+
+    def connected(self, from_x, from_y, to_x, to_y):
+        if (from_x, from_y) == (to_x, to_y):
+            return True
+        return self.label(to_x, to_y) in self.start_labels(from_x, from_y)
+
+    def nearest_reachable(self, from_x, from_y, to_x, to_y):
+        """Cell reachable from (from_x, from_y) that is closest to (to_x, to_y), or None"""
+        if self.connected(from_x, from_y, to_x, to_y):
+            return to_x, to_y
+        labels = list(self.start_labels(from_x, from_y))
+        if len(labels) == 0:
+            return None
+        xs, ys = numpy.nonzero(numpy.isin(self.labels, labels))
+        squared_distances = (xs - to_x) ** 2 + (ys - to_y) ** 2
+        closest = int(numpy.argmin(squared_distances))
+        return int(xs[closest]), int(ys[closest])
+
+    def update(self, x, y, navigable):
+        """Keep the labels current after the navigability of one cell changes"""
+        if not self.on_grid(x, y) or self.navigable[x, y] == navigable:
+            return
+        self.navigable[x, y] = navigable
+        if navigable:  # the new cell joins, and possibly merges, its neighboring components
+            self.labels[x, y] = UNREACHABLE
+            neighbor_labels = self.start_labels(x, y)
+            if len(neighbor_labels) == 0:
+                self.labels[x, y] = self.new_label()
+            else:
+                label = min(neighbor_labels)
+                self.labels[numpy.isin(self.labels, list(neighbor_labels))] = label
+                self.labels[x, y] = label
+        else:  # the component that lost this cell may have split in two or more
+            old_label = self.labels[x, y]
+            self.labels[x, y] = UNREACHABLE
+            component = self.labels == old_label
+            self.labels[component] = UNREACHABLE
+            self.label_cells(component)
@@ -0,0 +1,89 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# scenario files: a generated mission map saved so it can be loaded again as is
+#
+# A scenario holds what procedural generation produces: the terrain and marker
+# layers, the objective and rally point, every agent's placement, and the warbot,
+# OPFOR and civilian counts.  It is stored as an uncompressed numpy .npz archive of
+# plain arrays (no pickled objects), so loading a map is a few array reads.
+import numpy
+
+# bumped whenever the arrays in a scenario file change meaning
+SCENARIO_FORMAT_VERSION = 1
+
+# archive keys
+FORMAT_VERSION = "format_version"
+TERRAIN = "terrain"
+MARKERS = "markers"
+MISSION_POINTS = "mission_points"
+AGENT_NAMES = "agent_names"
+AGENT_LOCATIONS = "agent_locations"
+AGENT_COUNTS = "agent_counts"
+
+
+class Scenario:
+    """Contents of a scenario file"""
+    def __init__(self, terrain, markers, objective_location, rally_point_location, agents, counts):
+        self.terrain = terrain
+        self.markers = markers
+        self.objective_location = objective_location
+        self.rally_point_location = rally_point_location
+        # (name, (x, y)) of every agent: warbots, then OPFOR, then civilians, each in creation order
+        self.agents = agents
+        # warbot, OPFOR and civilian counts, as given to -r, -e and -c
+        self.counts = counts
+
+
+def save_scenario(mission_map, path):
+    """Write the terrain, markers and agent placements of mission_map to path"""
+    agents = []
+    for agent_locations in [mission_map.warbot_locations, mission_map.opfor_locations,
+                            mission_map.civilian_locations]:
+        if agent_locations is not None:
+            agents.extend(agent_locations.items())
+    names = [name for name, location in agents]
+    with open(path, 'wb') as scenario_file:
+        numpy.savez(scenario_file,
+                    **{FORMAT_VERSION: numpy.array(SCENARIO_FORMAT_VERSION, numpy.int32),
+                       TERRAIN: numpy.asarray(mission_map.grid.terrain, numpy.uint8),
+                       MARKERS: numpy.asarray(mission_map.grid.markers, numpy.uint8),
+                       MISSION_POINTS: numpy.array([[mission_map.objective_location.x, mission_map.objective_location.y],
+                                                    [mission_map.rally_point_location.x,
+                                                     mission_map.rally_point_location.y]], numpy.int32),
+                       AGENT_NAMES: numpy.array(names, dtype='U'),
+                       AGENT_LOCATIONS: numpy.array([[location.x, location.y] for name, location in agents],
+                                                    numpy.int32).reshape((len(agents), 2)),
+                       AGENT_COUNTS: numpy.array([len(mission_map.warbot_locations or ()),
+                                                  len(mission_map.opfor_locations or ()),
+                                                  len(mission_map.civilian_locations or ())], numpy.int32)})
+
+
+def load_scenario(path):
+    """Read a scenario file written by save_scenario; raises ValueError if it is not one this version reads"""
+    with numpy.load(path, allow_pickle=False) as archive:
+        if FORMAT_VERSION not in archive.files or int(archive[FORMAT_VERSION]) != SCENARIO_FORMAT_VERSION:
+            raise ValueError("{} is not a version {} scenario file".format(path, SCENARIO_FORMAT_VERSION))
+        terrain = archive[TERRAIN]
+        markers = archive[MARKERS]
+        mission_points = archive[MISSION_POINTS].tolist()
+        names = archive[AGENT_NAMES].tolist()
+        locations = [tuple(location) for location in archive[AGENT_LOCATIONS].tolist()]
+        counts = archive[AGENT_COUNTS].tolist()
+    if terrain.shape != markers.shape or len(names) != len(locations) or len(names) != sum(counts):
+        raise ValueError("{} holds inconsistent scenario arrays".format(path))
+    return Scenario(terrain, markers, tuple(mission_points[0]), tuple(mission_points[1]), list(zip(names, locations)),
+                    counts)
@@ -0,0 +1,84 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# shared grid: the packed mission map array in memory shared with the agent processes
+#
+# Sending each agent its visible map as a list of lists costs a tolist() copy, JSON
+# encoding and decoding, and a numpy.array copy per agent per turn.  Instead the
+# simulation copies the cells written since the last turn into shared memory and
+# bumps a version number in the header; your turn messages carry only the window
+# bounds and that version, and agents build their visible maps from a read-only
+# view of the window.
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+
+from shared.constants import GRID_CHUNK_SIZE
+from simulation.point import Point
+
+# header words in front of the cells: version, width, height
+SHARED_GRID_VERSION = 0
+SHARED_GRID_WIDTH = 1
+SHARED_GRID_HEIGHT = 2
+SHARED_GRID_HEADER_LENGTH = 3
+
+
+class SharedGrid:
+    """Versioned copy of a packed uint64 grid array that forked or spawned agent processes can read"""
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # plain shared memory without a lock: the simulation only publishes between turns
+        self.buffer = RawArray('Q', SHARED_GRID_HEADER_LENGTH + width * height)
+        header = self.header()
+        header[SHARED_GRID_WIDTH] = width
+        header[SHARED_GRID_HEIGHT] = height
+        # Grid.version as of the last publish, so that later publishes only copy the cells written since
+        self.published_grid_version = None
+
+    def header(self):
+        # views are made on demand so that only the RawArray itself is handed to child processes
+        return numpy.frombuffer(self.buffer, numpy.uint64, SHARED_GRID_HEADER_LENGTH)
+
+    def cells(self):
+        return numpy.frombuffer(self.buffer, numpy.uint64, offset=SHARED_GRID_HEADER_LENGTH * 8) \
+            .reshape((self.width, self.height))
+
+    def version(self):
+        return int(self.header()[SHARED_GRID_VERSION])
+
+    def publish(self, grid):
+        """Bring shared memory up to date with grid; returns the new version"""
+        cells = self.cells()
+        changed = None if self.published_grid_version is None else grid.changed_cells(self.published_grid_version)
+        if changed is None or len(changed) > self.width * self.height // 4:
+            # copy a strip of columns at a time so a chunked grid is never packed whole
+            for min_x in range(0, self.width, GRID_CHUNK_SIZE):
+                max_x = min(min_x + GRID_CHUNK_SIZE, self.width) - 1
+                cells[min_x:max_x + 1, :] = grid.window(min_x, 0, max_x, self.height - 1)
+        else:
+            for x, y in changed:
+                cells[x, y] = grid.cell_value(Point(x, y))
+        self.published_grid_version = grid.version
+        header = self.header()
+        header[SHARED_GRID_VERSION] += 1
+        return int(header[SHARED_GRID_VERSION])
+
+    def window(self, min_x, min_y, max_x, max_y):
+        """Read-only view of the cells from (min_x, min_y) to (max_x, max_y) inclusive"""
+        window = self.cells()[min_x:max_x + 1, min_y:max_y + 1]
+        window.flags.writeable = False
+        return window
@@ -0,0 +1,87 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# spatial hash of agent positions
+#
+# Agents are kept in two dictionaries: one from each cell to the agents in it,
+# answering "who is here" with one lookup, and one from square buckets of cells
+# to the agents in them, so "who is near here" only looks at the few buckets
+# that overlap the query instead of at every agent or every cell.
+from math import ceil, floor
+
+from shared.constants import SPATIAL_HASH_BUCKET_SIZE
+
+
+class SpatialHash:
+    """Cell and bucket indexes of entity IDs keyed by (x, y)"""
+    def __init__(self, bucket_size=SPATIAL_HASH_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        # (x, y) -> IDs in the cell, in the order they arrived
+        self.cells = {}
+        # (x // bucket_size, y // bucket_size) -> the cells of the bucket that hold at least one ID
+        self.buckets = {}
+
+    def clear(self):
+        self.cells.clear()
+        self.buckets.clear()
+
+    def bucket_of(self, x, y):
+        return x // self.bucket_size, y // self.bucket_size
+
+    def insert(self, entity_id, x, y):
+        entity_ids = self.cells.get((x, y))
+        if entity_ids is None:
+            entity_ids = []
+            self.cells[(x, y)] = entity_ids
+            self.buckets.setdefault(self.bucket_of(x, y), set()).add((x, y))
+        entity_ids.append(entity_id)
+
+    def remove(self, entity_id, x, y):
+        entity_ids = self.cells[(x, y)]
+        entity_ids.remove(entity_id)
+        if len(entity_ids) == 0:
+            del self.cells[(x, y)]
+            bucket = self.bucket_of(x, y)
+            bucket_cells = self.buckets[bucket]
+            bucket_cells.discard((x, y))
+            if len(bucket_cells) == 0:
+                del self.buckets[bucket]
+
+    def at(self, x, y):
+        """IDs in cell (x, y)"""
+        return self.cells.get((x, y), ())
+
+    def in_rectangle(self, min_x, min_y, max_x, max_y):
+        """((x, y), ID) of every entity with min_x <= x <= max_x and min_y <= y <= max_y, ordered by x, then y"""
+        min_bucket_x, min_bucket_y = self.bucket_of(min_x, min_y)
+        max_bucket_x, max_bucket_y = self.bucket_of(max_x, max_y)
+        found_cells = []
+        for bucket_x in range(min_bucket_x, max_bucket_x + 1):
+            for bucket_y in range(min_bucket_y, max_bucket_y + 1):
+                for x, y in self.buckets.get((bucket_x, bucket_y), ()):
+                    if min_x <= x <= max_x and min_y <= y <= max_y:
+                        found_cells.append((x, y))
+        found_cells.sort()
+        return [(cell, entity_id) for cell in found_cells for entity_id in self.cells[cell]]
+
+    def within(self, x, y, radius):
+        """((x, y), ID) of every entity no more than radius (straight line distance) from (x, y)"""
+        squared_radius = radius * radius
+        # only whole cells can be within radius, so a fractional radius rounds the bounds inward
+        candidates = self.in_rectangle(int(ceil(x - radius)), int(ceil(y - radius)),
+                                       int(floor(x + radius)), int(floor(y + radius)))
+        return [(cell, entity_id) for cell, entity_id in candidates
+                if (cell[0] - x) ** 2 + (cell[1] - y) ** 2 <= squared_radius]
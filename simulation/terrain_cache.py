@@ -0,0 +1,72 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# terrain cache: generated terrain layers saved as .npy files
+#
+# Terrain depends only on the seed, the map size and the noise parameters, so a
+# raster generated once can be reused by every later run with the same inputs.
+# Cached rasters are opened as copy-on-write memory maps: nothing is read until a
+# page is touched, and writes to the map stay private to the process.
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy
+
+
+class TerrainCache:
+    """Terrain layer rasters on disk, keyed by seed, size and noise parameters"""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, seed, width, height, parameters):
+        # the parameters are hashed so that the file name stays short whatever they hold
+        digest = hashlib.sha1(repr(parameters).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, "terrain_{}_{}x{}_{}.npy".format(seed, width, height, digest))
+
+    def load(self, seed, width, height, parameters):
+        """Copy-on-write memory map of the cached raster, or None if there is none"""
+        path = self.path(seed, width, height, parameters)
+        if not os.path.exists(path):
+            return None
+        try:
+            terrain = numpy.load(path, mmap_mode='c')
+        except (OSError, ValueError) as error:
+            logging.warning("Ignoring unreadable terrain cache file {}: {}".format(path, error))
+            return None
+        if terrain.shape != (width, height) or terrain.dtype != numpy.uint8:
+            logging.warning("Ignoring terrain cache file {} with shape {} and type {}"
+                            .format(path, terrain.shape, terrain.dtype))
+            return None
+        return terrain
+
+    def store(self, seed, width, height, parameters, terrain):
+        """Save a generated raster; a cache that cannot be written only costs the next run a regeneration"""
+        path = self.path(seed, width, height, parameters)
+        temp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written under a temporary name and renamed, so a concurrent run never loads a partial file
+            file_descriptor, temp_path = tempfile.mkstemp(suffix=".npy", dir=self.directory)
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                numpy.save(temp_file, numpy.asarray(terrain, numpy.uint8))
+            os.replace(temp_path, path)
+        except OSError as error:
+            logging.warning("Could not cache terrain in {}: {}".format(path, error))
+            # a partly written temporary file would otherwise stay in the cache directory for good
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
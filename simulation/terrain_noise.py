@@ -0,0 +1,127 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# vectorized Perlin noise
+#
+# A numpy port of noise.pnoise3 (the C implementation in the noise package) that
+# computes a whole raster per call instead of one cell per call.  It follows the C
+# code step for step in single precision, so for the same inputs it returns the
+# same values as pnoise3 and terrain thresholds land on exactly the same cells.
+import numpy
+
+# permutation table of the noise package's C code, doubled so that lookups never wrap
+PERMUTATION = numpy.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142, 8, 99, 37,
+    240, 21, 10, 23, 190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177,
+    33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134, 139, 48, 27, 166, 77, 146,
+    158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65, 25,
+    63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196, 135, 130, 116, 188, 159, 86, 164, 100,
+    109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206,
+    59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153,
+    101, 155, 167, 43, 172, 9, 129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246,
+    97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107, 49, 192,
+    214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114,
+    67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180] * 2)
+
+# gradient of each hash & 15 in the noise package's C code (its pure Python module differs), split by axis
+GRADIENTS = numpy.array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1),
+    (1, 0, -1), (-1, 0, -1), (0, -1, 1), (0, 1, 1)], numpy.float32)
+GRADIENTS_X = GRADIENTS[:, 0].copy()
+GRADIENTS_Y = GRADIENTS[:, 1].copy()
+GRADIENTS_Z = GRADIENTS[:, 2].copy()
+
+ONE = numpy.float32(1)
+SIX = numpy.float32(6)
+TEN = numpy.float32(10)
+FIFTEEN = numpy.float32(15)
+
+
+def fade(t):
+    return t * t * t * (t * (t * SIX - FIFTEEN) + TEN)
+
+
+def lerp(t, a, b):
+    return a + t * (b - a)
+
+
+def grad3(hash_value, x, y, z):
+    h = hash_value & 15
+    return x * GRADIENTS_X[h] + y * GRADIENTS_Y[h] + z * GRADIENTS_Z[h]
+
+
+def lattice(coordinate, repeat, base):
+    """Lattice cell of each coordinate and of the next cell along, wrapped at repeat and offset by base"""
+    repeat = numpy.float32(repeat)
+    cell = numpy.floor(numpy.fmod(coordinate, repeat)).astype(numpy.int64)
+    next_cell = numpy.fmod((cell + 1).astype(numpy.float32), repeat).astype(numpy.int64)
+    return (cell & 255) + base, (next_cell & 255) + base
+
+
+def noise3(x, y, z, repeatx, repeaty, repeatz, base):
+    """One octave of noise at every point of the float32 arrays x, y and z"""
+    i, ii = lattice(x, repeatx, base)
+    j, jj = lattice(y, repeaty, base)
+    k, kk = lattice(z, repeatz, base)
+    x = x - numpy.floor(x)
+    y = y - numpy.floor(y)
+    z = z - numpy.floor(z)
+    fx = fade(x)
+    fy = fade(y)
+    fz = fade(z)
+    a = PERMUTATION[i]
+    aa = PERMUTATION[a + j]
+    ab = PERMUTATION[a + jj]
+    b = PERMUTATION[ii]
+    ba = PERMUTATION[b + j]
+    bb = PERMUTATION[b + jj]
+    x1 = x - ONE
+    y1 = y - ONE
+    z1 = z - ONE
+    return lerp(fz, lerp(fy, lerp(fx, grad3(PERMUTATION[aa + k], x, y, z),
+                                  grad3(PERMUTATION[ba + k], x1, y, z)),
+                         lerp(fx, grad3(PERMUTATION[ab + k], x, y1, z),
+                              grad3(PERMUTATION[bb + k], x1, y1, z))),
+                lerp(fy, lerp(fx, grad3(PERMUTATION[aa + kk], x, y, z1),
+                              grad3(PERMUTATION[ba + kk], x1, y, z1)),
+                     lerp(fx, grad3(PERMUTATION[ab + kk], x, y1, z1),
+                          grad3(PERMUTATION[bb + kk], x1, y1, z1))))
+
+
+def pnoise3_grid(xs, ys, z, octaves=1, persistence=0.5, lacunarity=2.0, repeatx=1024, repeaty=1024, repeatz=1024,
+                 base=0):
+    """Array over xs by ys of pnoise3(x, y, z, ...) for every x in xs and y in ys"""
+    x, y = numpy.meshgrid(numpy.asarray(xs, numpy.float64).astype(numpy.float32),
+                          numpy.asarray(ys, numpy.float64).astype(numpy.float32), indexing='ij')
+    z = numpy.full(x.shape, z, numpy.float32)
+    persistence = numpy.float32(persistence)
+    lacunarity = numpy.float32(lacunarity)
+    if octaves == 1:
+        return noise3(x, y, z, repeatx, repeaty, repeatz, base).astype(numpy.float64)
+    frequency = numpy.float32(1)
+    amplitude = numpy.float32(1)
+    total_amplitude = numpy.float32(0)
+    total = numpy.zeros(x.shape, numpy.float32)
+    for octave in range(octaves):
+        total += noise3(x * frequency, y * frequency, z * frequency,
+                        int(numpy.float32(repeatx) * frequency), int(numpy.float32(repeaty) * frequency),
+                        int(numpy.float32(repeatz) * frequency), base) * amplitude
+        total_amplitude = total_amplitude + amplitude
+        frequency = frequency * lacunarity
+        amplitude = amplitude * persistence
+    return (total / total_amplitude).astype(numpy.float64)
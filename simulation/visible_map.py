@@ -26,16 +26,36 @@ from simulation.direction import Direction
 from simulation.drawable import Drawable
 from simulation.point import Point
 
+# bits of the mission points that scan records; agents are read from the grid's entity registry
+SCAN_MASK = Drawable.OBJECTIVE.value | Drawable.RALLY_POINT.value
+
 
 class VisibleMap(AbstractMap):
-    def __init__(self, array, x_offset, y_offset):
+    def __init__(self, array, x_offset, y_offset, entities=None, size=None):
+        """size, when given, is the widest window the map will hold, so that update can refill it in place"""
         AbstractMap.__init__(self)
-        self.grid.import_array(array)
-        self.x_offset = x_offset
-        self.y_offset = y_offset
+        if size is not None:
+            self.grid.reserve(size, size)
+        self.x_offset = None
+        self.y_offset = None
         self.opfor_locations = {}
         self.warbot_locations = {}
         self.civilian_locations = {}
+        self.update(array, x_offset, y_offset, entities)
+
+    def update(self, array, x_offset, y_offset, entities=None):
+        """Replace what the map shows with a new window, reusing the grid layers and location dicts"""
+        self.grid.import_array(array, entities)
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        self.objective_location = None
+        self.rally_point_location = None
+        self.opfor_locations.clear()
+        self.warbot_locations.clear()
+        self.civilian_locations.clear()
+        # the whole window changed, so route planning caches built for the last one are stale
+        self.reachability = None
+        self.terrain_version = self.terrain_version + 1
 
     def unoffset_point(self, point):
         # logging.debug("Underlying grid dimensions: width={}, height={}. x_offset={}, y_offset={}. Requested point: {}"
@@ -49,15 +69,11 @@ class VisibleMap(AbstractMap):
 
     def is_occupied(self, point):
         adjusted_point = self.unoffset_point(point)
-        for drawable in self.grid[adjusted_point]:
-            if drawable in AbstractMap.occupied:
-                return True
-        return False
+        return self.grid.is_occupied(adjusted_point)
 
     def is_navigable(self, point):
         adjusted_point = self.unoffset_point(point)
-        drawables = self.grid[adjusted_point]
-        return Drawable.WATER not in drawables
+        return not self.grid.any_of(adjusted_point, Drawable.WATER.value)
 
     def get_random_location_near_point(self, point, radius):
         while True:
@@ -177,18 +193,18 @@ class VisibleMap(AbstractMap):
         return candidate, path
 
     def scan(self):
-        for x in range(self.grid.width):
-            for y in range(self.grid.height):
-                current_point = Point(x, y)
-                drawables = self.grid[current_point]
-                for drawable in drawables:
-                    if drawable is Drawable.OBJECTIVE:
-                        self.objective_location = self.offset_point(current_point)
-                    elif drawable is Drawable.RALLY_POINT:
-                        self.rally_point_location = self.offset_point(current_point)
-                    elif drawable.name.startswith(WARBOT_PREFIX):
-                        self.warbot_locations[drawable.name] = self.offset_point(current_point)
-                    elif drawable.name.startswith(OPFOR_PREFIX):
-                        self.opfor_locations[drawable.name] = self.offset_point(current_point)
-                    elif drawable.name.startswith(CIVILIAN_PREFIX):
-                        self.civilian_locations[drawable.name] = self.offset_point(current_point)
+        # only the cells holding a scanned bit are decoded, instead of every cell of the map
+        for x, y, drawable in self.grid.drawables_with(SCAN_MASK):
+            current_point = Point(x, y)
+            if drawable is Drawable.OBJECTIVE:
+                self.objective_location = self.offset_point(current_point)
+            elif drawable is Drawable.RALLY_POINT:
+                self.rally_point_location = self.offset_point(current_point)
+        for name, (x, y) in self.grid.entities.placed():
+            current_point = Point(x, y)
+            if name.startswith(WARBOT_PREFIX):
+                self.warbot_locations[name] = self.offset_point(current_point)
+            elif name.startswith(OPFOR_PREFIX):
+                self.opfor_locations[name] = self.offset_point(current_point)
+            elif name.startswith(CIVILIAN_PREFIX):
+                self.civilian_locations[name] = self.offset_point(current_point)
@@ -0,0 +1,115 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# delta-encoded visible map updates
+#
+# Most cells of an agent's window are the same from one turn to the next.  The
+# simulation keeps a VisibleMapEncoder per agent holding the window it last sent,
+# and each turn sends only the new window bounds, the cells whose value differs
+# from what the agent already has, and the agent list when it changed.  The agent
+# keeps a VisibleMapDecoder with its copy of the window and applies the changes.
+# Both sides shift the old window to the new bounds the same way, so a cell that
+# comes into view counts as changed unless it is empty.
+import numpy
+
+from shared.constants import *
+
+
+def shift_window(cells, min_x, min_y, new_min_x, new_min_y, new_width, new_height):
+    """Packed cells of the new window that are known from the old one, with zeros for the rest"""
+    shifted = numpy.zeros((new_width, new_height), numpy.uint64)
+    if cells is None:
+        return shifted
+    # overlap of the two windows in mission map coordinates
+    low_x = max(min_x, new_min_x)
+    low_y = max(min_y, new_min_y)
+    high_x = min(min_x + cells.shape[0], new_min_x + new_width)
+    high_y = min(min_y + cells.shape[1], new_min_y + new_height)
+    if low_x < high_x and low_y < high_y:
+        shifted[low_x - new_min_x:high_x - new_min_x, low_y - new_min_y:high_y - new_min_y] = \
+            cells[low_x - min_x:high_x - min_x, low_y - min_y:high_y - min_y]
+    return shifted
+
+
+class VisibleMapEncoder:
+    """Simulation side: what one agent was last sent, and the changes since then"""
+    def __init__(self):
+        self.cells = None
+        self.min_x = None
+        self.min_y = None
+        # [name, x, y] in mission map coordinates
+        self.entities = None
+        # grid version when the window was last sent
+        self.grid_version = None
+
+    def encode(self, mission_map, point, distance):
+        """Visible map message contents for the window around point, holding only what changed"""
+        minus, plus = mission_map.get_visible_window(point, distance)
+        visible_map = {YOUR_LOCATION: point.to_dict(),
+                       CHANGES: [],
+                       MIN_X: minus.x,
+                       MIN_Y: minus.y,
+                       MAX_X: plus.x,
+                       MAX_Y: plus.y}
+        grid = mission_map.grid
+        unchanged_bounds = self.cells is not None and (self.min_x, self.min_y) == (minus.x, minus.y) and \
+            self.cells.shape == (plus.x - minus.x + 1, plus.y - minus.y + 1)
+        if unchanged_bounds and not grid.window_changed(minus.x, minus.y, plus.x, plus.y, self.grid_version):
+            # nothing in view was written since the last turn, agents included
+            self.grid_version = grid.version
+            return visible_map
+        cells = grid.window(minus.x, minus.y, plus.x, plus.y)
+        entities = mission_map.get_visible_entities(minus, plus)
+        absolute_entities = [[name, x + minus.x, y + minus.y] for name, x, y in entities]
+        known = shift_window(self.cells, self.min_x, self.min_y, minus.x, minus.y, cells.shape[0], cells.shape[1])
+        xs, ys = numpy.nonzero(cells != known)
+        visible_map[CHANGES] = [[x, y, value] for x, y, value in zip(xs.tolist(), ys.tolist(), cells[xs, ys].tolist())]
+        if absolute_entities != self.entities:
+            visible_map[ENTITIES] = entities
+        self.cells = cells.copy()
+        self.min_x = minus.x
+        self.min_y = minus.y
+        self.entities = absolute_entities
+        self.grid_version = grid.version
+        return visible_map
+
+
+class VisibleMapDecoder:
+    """Agent side: the window built up from the deltas received so far"""
+    def __init__(self):
+        self.cells = None
+        self.min_x = None
+        self.min_y = None
+        # [name, x, y] in mission map coordinates
+        self.entities = []
+
+    def apply(self, visible_map):
+        """Packed cells and [name, x, y] agent list of the window after applying a delta message"""
+        min_x = visible_map[MIN_X]
+        min_y = visible_map[MIN_Y]
+        cells = shift_window(self.cells, self.min_x, self.min_y, min_x, min_y,
+                             visible_map[MAX_X] - min_x + 1, visible_map[MAX_Y] - min_y + 1)
+        for x, y, value in visible_map[CHANGES]:
+            cells[x, y] = value
+        if ENTITIES in visible_map:
+            self.entities = [[name, x + min_x, y + min_y] for name, x, y in visible_map[ENTITIES]]
+        self.cells = cells
+        self.min_x = min_x
+        self.min_y = min_y
+        # handed out read-only so the agent's visible map cannot change what the next delta applies to
+        window = cells.view()
+        window.flags.writeable = False
+        return window, [[name, x - min_x, y - min_y] for name, x, y in self.entities]
@@ -0,0 +1,46 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# the cluster graph of a mission map must stay equal to a rebuilt one as cells are rewritten
+import random
+import unittest
+from argparse import Namespace
+
+from simulation.drawable import Drawable
+from simulation.hierarchical_path_finding import HierarchicalMap
+from simulation.missionmap import MissionMap
+from simulation.point import Point
+
+
+class HierarchicalMapTest(unittest.TestCase):
+    def test_set_cell_updates_cluster_graph(self):
+        random.seed(7)
+        mission_map = MissionMap(Namespace(load_scenario=None, width=48, height=40, lazy_terrain=False, t='',
+                                           r=3, e=3, c=3))
+        hierarchical_map = mission_map.get_hierarchical_map()
+        for step in range(100):
+            point = Point(random.randrange(mission_map.grid.width), random.randrange(mission_map.grid.height))
+            mission_map.set_cell(point, [random.choice([Drawable.WATER, Drawable.DIRT])])
+            self.assertIs(mission_map.get_hierarchical_map(), hierarchical_map)
+            expected = HierarchicalMap(mission_map.navigable_cells())
+            self.assertEqual(hierarchical_map.navigable, expected.navigable)
+            self.assertEqual(hierarchical_map.entrances, expected.entrances)
+            self.assertEqual(hierarchical_map.inter_edges, expected.inter_edges)
+            self.assertEqual(hierarchical_map.intra_edges, expected.intra_edges)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Jump Point Search must find paths as cheap as A* on the same map
+import unittest
+from random import Random
+
+from shared.constants import A_STAR, JUMP_POINT_SEARCH
+from simulation import a_star, jump_point_search
+from simulation.drawable import Drawable
+from simulation.point import Point
+from simulation.visible_map import VisibleMap
+
+MAP_SIZE = 20
+X_OFFSET = 5
+Y_OFFSET = 7
+
+
+def random_map(random, water_fraction):
+    array = [[Drawable.WATER.value if random.random() < water_fraction else Drawable.DIRT.value
+              for y in range(MAP_SIZE)]
+             for x in range(MAP_SIZE)]
+    return VisibleMap(array, X_OFFSET, Y_OFFSET)
+
+
+def path_cost(path):
+    """Octile length of path; every cell of the test maps costs 1 to enter"""
+    cost = 0
+    for index in range(1, len(path)):
+        if path[index].x != path[index - 1].x and path[index].y != path[index - 1].y:
+            cost = cost + jump_point_search.SQRT_2
+        else:
+            cost = cost + 1
+    return cost
+
+
+class JumpPointSearchTest(unittest.TestCase):
+    def assert_valid_path(self, my_map, path, from_location, to_location):
+        self.assertEqual(path[0], from_location)
+        self.assertEqual(path[-1], to_location)
+        for index in range(1, len(path)):
+            self.assertTrue(my_map.can_enter_route_plan(path[index]))
+            self.assertLessEqual(abs(path[index].x - path[index - 1].x), 1)
+            self.assertLessEqual(abs(path[index].y - path[index - 1].y), 1)
+
+    def test_same_cost_as_a_star(self):
+        random = Random(2)
+        for map_index in range(20):
+            my_map = random_map(random, 0.3)
+            for query_index in range(10):
+                from_location = Point(X_OFFSET + random.randrange(MAP_SIZE), Y_OFFSET + random.randrange(MAP_SIZE))
+                to_location = Point(X_OFFSET + random.randrange(MAP_SIZE), Y_OFFSET + random.randrange(MAP_SIZE))
+                if not (my_map.can_enter_route_plan(from_location) and my_map.can_enter_route_plan(to_location)):
+                    continue
+                a_star_path = a_star.find_path(my_map, from_location, to_location, A_STAR)
+                jump_point_path = a_star.find_path(my_map, from_location, to_location, JUMP_POINT_SEARCH)
+                if a_star_path is None:
+                    self.assertIsNone(jump_point_path)
+                    continue
+                self.assert_valid_path(my_map, a_star_path, from_location, to_location)
+                self.assert_valid_path(my_map, jump_point_path, from_location, to_location)
+                self.assertAlmostEqual(path_cost(a_star_path), path_cost(jump_point_path))
+
+    def test_open_map_takes_diagonal_steps(self):
+        my_map = random_map(Random(0), 0)
+        from_location = Point(X_OFFSET, Y_OFFSET)
+        to_location = Point(X_OFFSET + 10, Y_OFFSET + 4)
+        for algorithm in (A_STAR, JUMP_POINT_SEARCH):
+            path = a_star.find_path(my_map, from_location, to_location, algorithm)
+            self.assertEqual(len(path), 11)
+            self.assertAlmostEqual(path_cost(path), 6 + 4 * jump_point_search.SQRT_2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# the path planning service must plan the same paths as a_star under every process start method
+import multiprocessing
+import random
+import threading
+import unittest
+from argparse import Namespace
+
+from simulation import a_star
+from simulation.missionmap import MissionMap
+from simulation.path_service import PathService
+
+
+class PathServiceTest(unittest.TestCase):
+    def plan_with_start_method(self, start_method):
+        random.seed(6)
+        mission_map = MissionMap(Namespace(load_scenario=None, width=48, height=40, lazy_terrain=False, t='',
+                                           r=3, e=3, c=0))
+        queries = [(warbot_location, mission_map.objective_location)
+                   for warbot_location in mission_map.warbot_locations.values()]
+        paths = {}
+        delivered = threading.Semaphore(0)
+
+        def deliver_to(index):
+            def deliver(path):
+                paths[index] = path
+                delivered.release()
+            return deliver
+
+        default_start_method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method(start_method, force=True)
+        path_service = PathService(mission_map, 2)
+        try:
+            for index, (from_location, to_location) in enumerate(queries):
+                path_service.request_path(from_location, to_location, deliver_to(index))
+            for query in queries:
+                self.assertTrue(delivered.acquire(timeout=60))
+        finally:
+            path_service.shutdown()
+            multiprocessing.set_start_method(default_start_method, force=True)
+        for index, (from_location, to_location) in enumerate(queries):
+            self.assertEqual(paths[index], a_star.find_path(mission_map, from_location, to_location))
+
+    def test_fork(self):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest("fork is not available on this platform")
+        self.plan_with_start_method('fork')
+
+    def test_spawn(self):
+        self.plan_with_start_method('spawn')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# the reachability index of a mission map must stay equal to a fresh one as cells are rewritten
+import random
+import unittest
+from argparse import Namespace
+
+import numpy
+
+from simulation.drawable import Drawable
+from simulation.missionmap import MissionMap
+from simulation.point import Point
+from simulation.reachability import ReachabilityIndex, UNREACHABLE
+
+
+def small_mission_map(seed):
+    random.seed(seed)
+    return MissionMap(Namespace(load_scenario=None, width=48, height=40, lazy_terrain=False, t='', r=3, e=3, c=3))
+
+
+class ReachabilityIndexTest(unittest.TestCase):
+    def assert_same_components(self, index, expected):
+        """Labels may be numbered differently, but must split the cells into the same components"""
+        self.assertTrue((index.navigable == expected.navigable).all())
+        self.assertTrue(((index.labels == UNREACHABLE) == (expected.labels == UNREACHABLE)).all())
+        navigable = expected.navigable
+        label_pairs = set(zip(index.labels[navigable].tolist(), expected.labels[navigable].tolist()))
+        self.assertEqual(len(label_pairs), len(numpy.unique(index.labels[navigable])))
+        self.assertEqual(len(label_pairs), len(numpy.unique(expected.labels[navigable])))
+
+    def test_set_cell_updates_index(self):
+        mission_map = small_mission_map(4)
+        index = mission_map.reachability_index()
+        for step in range(200):
+            point = Point(random.randrange(mission_map.grid.width), random.randrange(mission_map.grid.height))
+            mission_map.set_cell(point, [random.choice([Drawable.WATER, Drawable.DIRT])])
+            self.assertIs(mission_map.reachability_index(), index)
+            self.assert_same_components(index, ReachabilityIndex(mission_map.navigable_cells()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Autonomous Squad Assault
+# Copyright (C) 2019  Richard Scott McNew.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# a warbot must walk its partial path while a node-budgeted search is still running
+import json
+import random
+import unittest
+from argparse import Namespace
+from queue import Queue
+
+from agent.agent_messages import your_turn_message
+from shared.constants import *
+from simulation import a_star
+from simulation.missionmap import MissionMap
+from simulation.point import Point
+from warbot.warbot import Warbot
+from warbot.warbot_radio_broker import WarbotRadioBroker
+
+WARBOT_NAME = WARBOT_PREFIX + "1"
+
+
+def chebyshev_distance(from_location, to_location):
+    return max(abs(from_location.x - to_location.x), abs(from_location.y - to_location.y))
+
+
+class BudgetedPathSearchTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.mission_map = MissionMap(Namespace(load_scenario=None, width=48, height=40, lazy_terrain=False, t='',
+                                                r=2, e=1, c=0))
+        location = self.mission_map.warbot_locations[WARBOT_NAME]
+        self.warbot = Warbot(Queue(), Queue(), location, None, WARBOT_NAME, Queue(), WarbotRadioBroker(Queue()),
+                             self.mission_map.objective_location, self.mission_map.rally_point_location,
+                             self.mission_map.grid.width, self.mission_map.grid.height)
+        self.warbot.team_state = MOVEMENT_TO_OBJECTIVE
+        self.warbot.update_location_and_visible_map(self.visible_map(location))
+        a_star.set_node_budget(20)
+
+    def tearDown(self):
+        a_star.set_node_budget(0)
+
+    def visible_map(self, location):
+        return self.mission_map.get_visible_map_around_point(location, WARBOT_VISION_DISTANCE)
+
+    def far_target(self, location):
+        """A cell in sight that the warbot needs many steps to reach"""
+        visible_map = self.warbot.visible_map
+        for distance in range(WARBOT_VISION_DISTANCE, 0, -1):
+            for vector in [(distance, 0), (-distance, 0), (0, distance), (0, -distance)]:
+                target = location.plus_vector(vector)
+                if visible_map.on_map(target) and self.mission_map.can_enter(target):
+                    path = a_star.find_path(visible_map, location, target)
+                    if path is not None and len(path) > 8:
+                        return target
+        self.fail("no far target in sight")
+
+    def take_turn(self):
+        """Send the warbot its turn and carry out the move it asks for"""
+        location = self.mission_map.warbot_locations[WARBOT_NAME]
+        self.warbot.to_me_queue.put(your_turn_message(self.visible_map(location)))
+        self.warbot.do_sim_tasks()
+        action = json.loads(self.warbot.from_me_queue.get_nowait())
+        self.assertEqual(action[ACTION], MOVE_TO)
+        requested_location = Point.from_dict(action[LOCATION])
+        self.mission_map.move_agent(WARBOT_NAME, requested_location)
+        return location, requested_location
+
+    def test_moves_one_cell_per_turn_while_searching(self):
+        location = self.warbot.location
+        self.warbot.path = self.warbot.plan_path(self.far_target(location))
+        turns = 0
+        while not self.warbot.path_search.complete:
+            location, requested_location = self.take_turn()
+            self.assertEqual(chebyshev_distance(location, requested_location), 1)
+            turns = turns + 1
+        self.assertGreater(turns, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
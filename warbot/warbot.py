@@ -14,12 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+from math import sqrt
 from time import sleep
 
 from agent.agent import Agent
 from agent.agent_messages import *
 from shared.functions import distance
 from simulation import a_star
+from simulation.d_star_lite import DStarLitePlanner
 from simulation.direction import Direction
 from simulation.point import Point
 from warbot.warbot_messages import *
@@ -29,13 +31,24 @@ from warbot.warbot_radio import WarbotRadio
 class Warbot(Agent):
     """Represents an autonomous robotic warrior"""
     def __init__(self, to_me_queue, from_me_queue, initial_location, initial_visible_map, name,
-                 to_this_warbot_queue, warbot_radio_broker, objective_location, rally_point_location):
+                 to_this_warbot_queue, warbot_radio_broker, objective_location, rally_point_location,
+                 map_width, map_height, flow_fields=None, hierarchical_map=None, use_path_service=False, shared_grid=None):
         Agent.__init__(self, to_me_queue, from_me_queue, initial_location,
-                       initial_visible_map, WARBOT_VISION_DISTANCE, name)
+                       initial_visible_map, WARBOT_VISION_DISTANCE, name, shared_grid)
         self.radio = WarbotRadio(self.name, to_this_warbot_queue, warbot_radio_broker)
         self.path = []
+        # kept across turns so a blocked path is repaired instead of planned from scratch
+        self.planner = DStarLitePlanner(map_width, map_height)
+        # unfinished node-budgeted search that is resumed each turn
+        self.path_search = None
         self.objective_location = objective_location
         self.rally_point_location = rally_point_location
+        # shared flow fields from the simulation, keyed by goal (x, y)
+        self.flow_fields = flow_fields if flow_fields is not None else {}
+        # shared cluster graph of the whole mission map for long-range path finding
+        self.hierarchical_map = hierarchical_map
+        # ask the simulation's path planning service for paths instead of searching the visible map
+        self.use_path_service = use_path_service
         self.run_simulation = True
         self.warbot_names = set()
         self.squad_leader = None  # squad leader is also team_a leader
@@ -49,6 +62,9 @@ class Warbot(Agent):
         self.limit_of_advance_attained = set()
         self.security_established = set()
         self.moving = False
+        self.requested_location = None
+        # the last step the simulation refused, so a step refused twice in a row is planned around
+        self.refused_location = None
         self.firing = False
         self.fire_direction = None
         self.flanking_position = None
@@ -90,6 +106,64 @@ class Warbot(Agent):
         else:
             return self.team_b.index(self.name)
 
+    def plan_path(self, target):
+        """Path from the current location to target, read from a shared flow field when one exists for target"""
+        self.path_search = None
+        flow_field = self.flow_fields.get((target.x, target.y))
+        if flow_field is not None:
+            path = flow_field.path_from(self.location)
+            if path is not None:
+                return path
+        if self.use_path_service:
+            return self.request_path(self.location, target)
+        if a_star.node_budget > 0:
+            return self.start_path_search(target)
+        return a_star.find_path(self.visible_map, self.location, target)
+
+    def start_path_search(self, target):
+        """Begin a budgeted search to target; the rest of the search runs one budget per turn"""
+        if not self.visible_map.is_reachable(self.location, target):
+            return None
+        self.path_search = a_star.BudgetedPathSearch(self.location, target)
+        return self.path_search.resume(self.visible_map, self.location, a_star.node_budget)
+
+    def continue_path_search(self):
+        """Spend this turn's node budget on an unfinished search and follow its best path so far"""
+        if self.path_search is None or self.path_search.complete:
+            return
+        path = self.path_search.resume(self.visible_map, self.location, a_star.node_budget)
+        if path is None:  # we have left the search tree, so search again from here
+            path = self.start_path_search(self.path_search.to_location)
+        if path is not None:
+            if len(path) > 0 and path[0] == self.location:
+                path = path[1:]  # the path is rebuilt from where we stand every turn; step off our own cell
+            self.path = path
+
+    def plan_long_range_path(self, target):
+        """Leg of the hierarchical path to target that stays on the visible map; None without a cluster graph"""
+        if self.hierarchical_map is None:
+            return None
+        self.path_search = None
+        path = self.hierarchical_map.find_path(self.location, target)
+        if path is None:
+            return None
+        leg_length = 1
+        while leg_length < len(path) and self.visible_map.on_map(path[leg_length]):
+            leg_length = leg_length + 1
+        return path[:leg_length]
+
+    def replan_path(self, target):
+        """Path around agents now blocking the current path, repaired incrementally by the D* Lite planner"""
+        self.path_search = None
+        return self.planner.plan(self.visible_map, self.location, target)
+
+    def visible_squadmate_locations(self):
+        """Warbot name -> location of every other warbot in sight, from the visible map's spatial hash"""
+        # a radius reaching the corners of the square visible window
+        squadmates = self.visible_map.get_agents_near_point(self.location, self.sight_radius * sqrt(2), WARBOT_PREFIX)
+        squadmates.pop(self.name, None)
+        return squadmates
+
     def opfor_visible(self):
         return len(self.visible_map.opfor_locations) > 0
 
@@ -273,7 +347,7 @@ class Warbot(Agent):
             self.movement_target = self.calculate_rally_point_squad_column_wedge_position()
             logging.debug("{}: My squad column wedge position is: {}.  Starting A* path finding from {} to {}"
                           .format(self.name, self.movement_target, self.location, self.movement_target))
-            self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+            self.path = self.plan_path(self.movement_target)
             logging.debug("{}: Found A* path from {} to {} as {}"
                           .format(self.name, self.location, self.movement_target, self.path))
         elif self.location != self.movement_target:
@@ -289,8 +363,8 @@ class Warbot(Agent):
                     else:
                         logging.debug("{}: Next location {} is blocked.  Replanning route from {} to {}"
                                       .format(self.name, self.path[0], self.location, self.movement_target))
-                        self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
-                        logging.debug("{}: Found en route A* path from {} to {} as {}"
+                        self.path = self.replan_path(self.movement_target)
+                        logging.debug("{}: Found en route D* Lite path from {} to {} as {}"
                                       .format(self.name, self.location, self.movement_target, self.path))
                 else:  # if the path is empty, just wait
                     sleep(0.3)
@@ -339,15 +413,22 @@ class Warbot(Agent):
                                   "Starting A* path finding from {} to {}"
                                   .format(self.name, self.visible_map.objective_location,
                                           self.location, self.movement_target))
-                    self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                    self.path = self.plan_path(self.movement_target)
                 else:  # else move in general direction
                     logging.debug("{}: Objective is NOT on visible map.  Moving in general direction".format(self.name))
-                    next_waypoint = self.visible_map.find_closest_top_point(Point(self.objective_location.x,
-                                           self.objective_location.y + WARBOT_VISION_DISTANCE - 2))
+                    assault_position = Point(self.objective_location.x,
+                                             self.objective_location.y + WARBOT_VISION_DISTANCE - 2)
+                    long_range_path = self.plan_long_range_path(assault_position)
+                    if long_range_path is not None:  # the furthest visible step of the hierarchical path
+                        next_waypoint = long_range_path[-1]
+                        self.movement_target = next_waypoint
+                        self.path = long_range_path
+                    else:
+                        next_waypoint = self.visible_map.find_closest_top_point(assault_position)
+                        self.movement_target = next_waypoint
+                        self.path = self.plan_path(self.movement_target)
                     logging.debug("{}: Calculated next_waypoint is: {}".format(self.name, next_waypoint))
-                    self.movement_target = next_waypoint
-                    self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
-                    logging.debug("{}: A* path to next_waypoint is: {}".format(self.name, self.path))
+                    logging.debug("{}: Path to next_waypoint is: {}".format(self.name, self.path))
                     self.radio.send(squad_leader_waypoint_message(next_waypoint))
             else:  # I am not the squad leader
                 # is objective on visible map
@@ -357,7 +438,7 @@ class Warbot(Agent):
                                   "Starting A* path finding from {} to {}"
                                   .format(self.name, self.visible_map.objective_location,
                                           self.location, self.movement_target))
-                    self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                    self.path = self.plan_path(self.movement_target)
                 else:  # follow the squad leader's waypoints
                     logging.debug("{}: Following squad leader in traveling squad column wedge".format(self.name))
                     warbot_message = self.radio.receive_message()
@@ -366,7 +447,7 @@ class Warbot(Agent):
                             waypoint = Point.from_dict(warbot_message[WAYPOINT])
                             self.movement_target = self.calculate_traveling_squad_column_wedge_position(waypoint)
                             logging.debug("{}: Movement target is: {}".format(self.name, self.movement_target))
-                            self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                            self.path = self.plan_path(self.movement_target)
                             logging.debug("{}: A* path to movement target is: {}".format(self.name, self.path))
                         elif warbot_message[MESSAGE_TYPE] == OPFOR_CONTACT:
                             self.team_state = OPFOR_CONTACT
@@ -410,7 +491,7 @@ class Warbot(Agent):
             logging.debug("{}: Notifying Team A of suppressive fire position: {}"
                           .format(self.name, self.flanking_position))
             self.radio.send(suppressive_fire_position_message(self.flanking_position))
-            self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+            self.path = self.plan_path(self.movement_target)
         elif self.i_am_squad_leader() and self.flanking_position == self.location:
             # receive / accumulate messages from Team B until they are all ready to flank
             warbot_message = self.radio.receive_message()
@@ -437,7 +518,7 @@ class Warbot(Agent):
                         Point.from_dict(warbot_message[LOCATION]))
                     self.movement_target = self.flanking_position
                     logging.debug("{}: suppressive fire position is: {}".format(self.name, self.movement_target))
-                    self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                    self.path = self.plan_path(self.movement_target)
                     logging.debug("{}: A* path to suppressive fire position is: {}".format(self.name, self.path))
             else:
                 sleep(0.3)
@@ -493,7 +574,7 @@ class Warbot(Agent):
                             self.flanking_position_waypoint)
                     logging.debug("{}: Finding path to flanking position waypoint: {}"
                                   .format(self.name, self.movement_target))
-                    self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                    self.path = self.plan_path(self.movement_target)
                     logging.debug("{}: A* path to waypoint is: {}".format(self.name, self.path))
 
             elif self.flanking_position_waypoint_reached and not self.flanking_position_reached:
@@ -505,7 +586,7 @@ class Warbot(Agent):
                     self.movement_target = self.visible_map.find_closest_top_point(self.flanking_position)
                     logging.debug("{}: Finding path to flanking position: {}"
                                   .format(self.name, self.movement_target))
-                    self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                    self.path = self.plan_path(self.movement_target)
                     logging.debug("{}: A* path to waypoint is: {}".format(self.name, self.path))
 
             elif self.flanking_position_reached:
@@ -558,8 +639,12 @@ class Warbot(Agent):
 
     def lift_and_shift_fire_team_b(self):
         if self.limit_of_advance is None:
-            half_limit_of_advance = distance(self.visible_map.warbot_locations[self.team_b_leader],
-                                             self.objective_location)
+            # the sweep picks each step from where we stand, so a refused step is dropped, not planned around
+            self.movement_target = None
+            # the sweep is as long as the team leader is far from the objective; use our own
+            # distance if the team leader is out of sight
+            team_b_leader_location = self.visible_squadmate_locations().get(self.team_b_leader, self.location)
+            half_limit_of_advance = distance(team_b_leader_location, self.objective_location)
             if self.visible_map.is_left_of_me(self.objective_location, self.location):
                 advance_vector = Direction.WEST.to_scaled_vector(2 * half_limit_of_advance)
                 self.limit_of_advance = self.location.plus_vector(advance_vector)
@@ -579,12 +664,20 @@ class Warbot(Agent):
                 self.last_objective_clearance_action = SHOOT
             else:
                 self.fire_direction = None
-                next_step = self.location.plus_direction(self.objective_clearance_direction)
-                self.path.append(next_step)
+                next_step = self.next_sweep_step()
+                self.path_search = None
                 self.last_objective_clearance_action = MOVE
-                if next_step == self.limit_of_advance:
+                if next_step is None:
+                    # water or the edge of the map ends the sweep early
+                    logging.debug("{}: Cannot sweep past {}; stopping there".format(self.name, self.location))
                     self.radio.send(limit_of_advance_message(self.name))
                     self.limit_of_advance_reached = True
+                elif next_step != self.location:
+                    self.path.append(next_step)
+                    # at or past the limit of advance, which may lie between cells
+                    if (next_step.x - self.limit_of_advance.x) * self.objective_clearance_direction.value[0] >= 0:
+                        self.radio.send(limit_of_advance_message(self.name))
+                        self.limit_of_advance_reached = True
             sleep(0.2)
         else:  # wait for squad leader to call "secure objective"
             warbot_message = self.radio.receive_message()
@@ -595,6 +688,21 @@ class Warbot(Agent):
             else:
                 sleep(0.3)
 
+    def next_sweep_step(self):
+        """Cell to sweep into next: straight ahead, or diagonally ahead around an agent in the way.
+           Our own location when every cell ahead is taken, None when none of them can be entered at all"""
+        ahead_x = self.objective_clearance_direction.value[0]
+        steps = [self.location.plus_vector((ahead_x, 0)),
+                 self.location.plus_vector((ahead_x, 1)),
+                 self.location.plus_vector((ahead_x, -1))]
+        steps = [step for step in steps if self.visible_map.can_enter_route_plan(step)]
+        if len(steps) == 0:
+            return None
+        for step in steps:
+            if self.visible_map.can_enter(step):
+                return step
+        return self.location
+
     def lift_and_shift_fire(self):
         # logging.debug("{}: Lifting and shifting fire".format(self.name))
         if not self.moving:
@@ -648,16 +756,23 @@ class Warbot(Agent):
                         self.secure_objective_location)
                 logging.debug("{}: Finding path in direction of secure_objective_location : {}"
                               .format(self.name, self.movement_target))
-                self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                self.path = self.plan_path(self.movement_target)
                 logging.debug("{}: A* path towards secure_objective_location is: {}".format(self.name, self.path))
             # if we know where we are supposed to go and can see it, find the path
             elif self.secure_objective_location is not None and \
                     (self.visible_map.on_map(self.secure_objective_location)) and \
                     not self.secure_objective_location_route_planned:
+                reachable_location = self.visible_map.nearest_reachable_location(self.location,
+                                                                                 self.secure_objective_location)
+                if reachable_location is not None and reachable_location != self.secure_objective_location:
+                    # the assigned position is water or cut off, so hold the closest reachable spot instead
+                    logging.debug("{}: security perimeter position {} is unreachable; using {}"
+                                  .format(self.name, self.secure_objective_location, reachable_location))
+                    self.secure_objective_location = reachable_location
                 self.movement_target = self.secure_objective_location
                 logging.debug("{}: Finding path to security perimeter position: {}"
                               .format(self.name, self.movement_target))
-                self.path = a_star.find_path(self.visible_map, self.location, self.movement_target)
+                self.path = self.plan_path(self.movement_target)
                 logging.debug("{}: A* path to security perimeter position is: {}".format(self.name, self.path))
                 self.secure_objective_location_route_planned = True
                 sleep(0.2)
@@ -716,6 +831,27 @@ class Warbot(Agent):
             logging.error("do_warbot_tasks: {}: Should not get here!  Bad team state: {}"
                           .format(self.name, self.team_state))
 
+    def take_next_path_step(self):
+        self.moving = True
+        self.requested_location = self.path.pop(0)
+        return take_turn_move_message(self.name, self.requested_location)
+
+    def rejoin_path(self):
+        """The simulation held or diverted the last move to avoid a collision, so get back on the path"""
+        logging.debug("{}: Requested move to {} was not granted; now at {}"
+                      .format(self.name, self.requested_location, self.location))
+        refused_before = self.refused_location is not None and self.requested_location == self.refused_location
+        self.refused_location = self.requested_location
+        # retry a step we are still next to, unless it was refused before or is now blocked
+        if distance(self.location, self.requested_location) < 2 and not refused_before and \
+                self.visible_map.can_enter(self.requested_location) and \
+                self.visible_map.can_enter_route_plan(self.requested_location):
+            self.path.insert(0, self.requested_location)
+        elif self.movement_target is not None:
+            path = self.replan_path(self.movement_target)
+            if path is not None:
+                self.path = path
+
     def determine_turn_action(self):
         if self.team_state == CONDUCT_ELECTION:
             return take_turn_do_nothing_message(self.name)
@@ -725,22 +861,19 @@ class Warbot(Agent):
 
         elif self.team_state == FORM_SQUAD_COLUMN_WEDGE:
             if len(self.path) > 0:
-                self.moving = True
-                return take_turn_move_message(self.name, self.path.pop(0))
+                return self.take_next_path_step()
             else:
                 return take_turn_do_nothing_message(self.name)
 
         elif self.team_state == MOVEMENT_TO_OBJECTIVE:
             if len(self.path) > 0:
-                self.moving = True
-                return take_turn_move_message(self.name, self.path.pop(0))
+                return self.take_next_path_step()
             else:
                 return take_turn_do_nothing_message(self.name)
 
         elif self.team_state == OPFOR_CONTACT:
             if len(self.path) > 0:
-                self.moving = True
-                return take_turn_move_message(self.name, self.path.pop(0))
+                return self.take_next_path_step()
             elif self.fire_direction is not None:
                 self.firing = True
                 return take_turn_fire_message(self.name, self.location, self.fire_direction)
@@ -749,8 +882,7 @@ class Warbot(Agent):
 
         elif self.team_state == LIFT_AND_SHIFT_FIRE:
             if len(self.path) > 0:
-                self.moving = True
-                return take_turn_move_message(self.name, self.path.pop(0))
+                return self.take_next_path_step()
             elif self.fire_direction is not None:
                 self.firing = True
                 return take_turn_fire_message(self.name, self.location, self.fire_direction)
@@ -759,8 +891,7 @@ class Warbot(Agent):
 
         elif self.team_state == SECURE_OBJECTIVE:
             if len(self.path) > 0:
-                self.moving = True
-                return take_turn_move_message(self.name, self.path.pop(0))
+                return self.take_next_path_step()
             else:
                 return take_turn_do_nothing_message(self.name)
 
@@ -779,7 +910,12 @@ class Warbot(Agent):
                 self.update_location_and_visible_map(sim_message[VISIBLE_MAP])
                 self.visible_map.scan()
                 if self.moving:
+                    if self.location != self.requested_location:
+                        self.rejoin_path()
+                    else:
+                        self.refused_location = None
                     self.moving = False
+                self.continue_path_search()
                 if self.firing:
                     self.firing = False
                 turn_action = self.determine_turn_action()